@@ -0,0 +1,279 @@
+"""複数薬局のアップロードを一括処理するコマンドラインツール
+
+Streamlit を使わずに FileProcessor で (購入履歴, 不良在庫, 在庫金額) の組を
+プロセスプールで並列に処理し、組ごとに引き取り依頼Excelを出力する。
+購入履歴と在庫金額は同じファイルを複数の組で共有でき、読み込みと索引の
+作成はファイルごとに一度だけ行って各ワーカーに渡す。
+
+ディレクトリ内の不良在庫CSVをすべて処理する場合:
+
+    python batch.py --purchase omec.xlsx --master stock_value.csv --out reports inventories/
+
+マニフェスト（CSVまたはJSON、列は name・purchase・inventory・master）を使う場合:
+
+    python batch.py --manifest sets.csv --out reports
+
+--csv を指定すると、不良在庫CSVをチャンク単位で処理して結果をCSVへ逐次
+書き出す（FileProcessor.process_data_chunked）。院所別のシート分けはなく
+入力順の1ファイルとなるが、メモリ使用量は不良在庫CSVの行数に依存しない。
+
+いずれかの組が失敗した場合は終了コード 1 で終了する。
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from file_processor import FileProcessor
+from instrumentation import pipeline_run
+
+# ワーカーに一度だけ渡す共有データ（パス → 購入履歴の索引・照合エンジン）
+_shared = {'purchases': {}, 'masters': {}}
+
+
+def _read_file(path):
+    # FileProcessor は getvalue() を持つアップロードファイルを受け取る
+    with open(path, 'rb') as f:
+        return io.BytesIO(f.read())
+
+
+def load_manifest(path, purchase=None, master=None):
+    """マニフェストから処理する組の一覧を読み込む
+
+    相対パスはマニフェストのあるディレクトリからの位置とみなす。
+    purchase・master 列が空の組には引数の既定値を使う。
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    if path.endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+    else:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            entries = list(csv.DictReader(f))
+
+    sets = []
+    for entry in entries:
+        paths = {}
+        for kind, default in [('purchase', purchase), ('inventory', None), ('master', master)]:
+            value = (entry.get(kind) or '').strip()
+            paths[kind] = os.path.join(base_dir, value) if value else default
+        name = (entry.get('name') or '').strip() or os.path.splitext(os.path.basename(paths['inventory'] or ''))[0]
+        sets.append({'name': name, **paths})
+    return sets
+
+
+def scan_directory(directory, purchase, master):
+    """ディレクトリ内の不良在庫CSVごとに、共通の購入履歴・在庫金額との組を作る"""
+    return [
+        {
+            'name': os.path.splitext(file_name)[0],
+            'purchase': purchase,
+            'inventory': os.path.join(directory, file_name),
+            'master': master,
+        }
+        for file_name in sorted(os.listdir(directory))
+        if file_name.lower().endswith('.csv')
+    ]
+
+
+def _load_purchase(path):
+    purchase_df = FileProcessor.read_purchase_history(_read_file(path))
+    return FileProcessor.build_purchase_index(purchase_df)
+
+
+def _load_master(path):
+    yj_code_df = FileProcessor.read_csv(_read_file(path))
+    return FileProcessor.build_drug_matcher(FileProcessor._build_yj_mapping(yj_code_df))
+
+
+def _init_worker(purchases, masters, quiet):
+    _shared['purchases'] = purchases
+    _shared['masters'] = masters
+    if quiet:
+        logging.getLogger('pipeline').setLevel(logging.WARNING)
+
+
+def process_set(entry, out_dir, top_n=None, bundle=False, as_csv=False, chunksize=50000):
+    """1組を処理して結果ファイルを書き出し、結果の概要を返す（ワーカーで実行）"""
+    summary = {'name': entry['name'], 'inventory': entry['inventory']}
+    start = time.perf_counter()
+    try:
+        with pipeline_run('batch', set=entry['name']) as run:
+            yj_mapping = _shared['masters'][entry['master']]
+            purchase_index = _shared['purchases'][entry['purchase']]
+            base_name = entry.get('file_name') or FileProcessor._clean_file_name(entry['name'])
+
+            if as_csv:
+                # 在庫データはファイルから直接チャンク単位で読み込み、処理して書き出す
+                output = os.path.join(out_dir, f"{base_name}.csv")
+                rows = FileProcessor.process_data_chunked(
+                    None,
+                    entry['inventory'],
+                    None,
+                    output,
+                    chunksize=chunksize,
+                    yj_mapping=yj_mapping,
+                    purchase_index=purchase_index,
+                    top_n=top_n
+                )
+            else:
+                inventory_df = FileProcessor.read_csv(_read_file(entry['inventory']), file_type='inventory')
+                result_df = FileProcessor.process_data(
+                    None,
+                    inventory_df,
+                    yj_mapping=yj_mapping,
+                    purchase_index=purchase_index,
+                    top_n=top_n
+                )
+                rows = len(result_df)
+                if bundle:
+                    # ワーカー内でさらにプロセスを起動しないよう同一プロセスで生成
+                    report = FileProcessor.generate_excel_bundle(result_df, max_workers=1)
+                    output = os.path.join(out_dir, f"{base_name}.zip")
+                else:
+                    report = FileProcessor.generate_excel(result_df)
+                    output = os.path.join(out_dir, f"{base_name}.xlsx")
+
+                with open(output, 'wb') as f:
+                    f.write(report.getvalue())
+
+        summary.update({
+            'status': 'ok',
+            'rows': rows,
+            'output': output,
+            'stages': {record['stage']: round(record['seconds'], 3) for record in run.stages},
+        })
+    except Exception as e:
+        summary.update({'status': 'failed', 'error': str(e)})
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def run_batch(sets, out_dir, max_workers=None, top_n=None, bundle=False, quiet=False,
+              as_csv=False, chunksize=50000):
+    """全組を処理し、組ごとの結果の概要のリストを返す"""
+    os.makedirs(out_dir, exist_ok=True)
+    # 出力ファイル名が重複しないよう、置換後のファイル名を一意にする
+    # （大文字・小文字を区別しないファイルシステムでも上書きしないよう小文字で比較）
+    used_names = set()
+    for entry in sets:
+        base_name = FileProcessor._clean_file_name(entry['name'] or 'set')
+        file_name, suffix = base_name, 2
+        while file_name.lower() in used_names:
+            file_name = f"{base_name}_{suffix}"
+            suffix += 1
+        used_names.add(file_name.lower())
+        entry['file_name'] = file_name
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_worker,
+        initargs=({}, {}, quiet)
+    ) as executor:
+        # 共有する購入履歴・在庫金額を、ファイルごとに一度だけ並列に読み込む
+        purchase_paths = sorted({entry['purchase'] for entry in sets})
+        master_paths = sorted({entry['master'] for entry in sets})
+        purchase_jobs = {path: executor.submit(_load_purchase, path) for path in purchase_paths}
+        master_jobs = {path: executor.submit(_load_master, path) for path in master_paths}
+
+        purchases, masters, load_errors = {}, {}, {}
+        for tables, jobs in [(purchases, purchase_jobs), (masters, master_jobs)]:
+            for path, job in jobs.items():
+                try:
+                    tables[path] = job.result()
+                except Exception as e:
+                    load_errors[path] = str(e)
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_worker,
+        initargs=(purchases, masters, quiet)
+    ) as executor:
+        results = []
+        for entry in sets:
+            # 共有ファイルの読み込みに失敗した組は処理せずに失敗として記録
+            failed = [path for path in (entry['purchase'], entry['master']) if path in load_errors]
+            if failed:
+                results.append({
+                    'name': entry['name'],
+                    'inventory': entry['inventory'],
+                    'status': 'failed',
+                    'error': '; '.join(f"{path}: {load_errors[path]}" for path in failed),
+                    'seconds': 0.0,
+                })
+            else:
+                results.append(executor.submit(
+                    process_set, entry, out_dir, top_n, bundle, as_csv, chunksize
+                ))
+        return [result if isinstance(result, dict) else result.result() for result in results]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='不良在庫データを一括処理して引き取り依頼Excelを出力する')
+    parser.add_argument('directory', nargs='?', help='不良在庫CSVを置いたディレクトリ')
+    parser.add_argument('--manifest', help='処理する組を記載したCSVまたはJSON')
+    parser.add_argument('--purchase', help='OMEC他院所ファイル（XLSX、マニフェストの既定値）')
+    parser.add_argument('--master', help='在庫金額ファイル（CSV、マニフェストの既定値）')
+    parser.add_argument('--out', required=True, help='出力ディレクトリ')
+    parser.add_argument('--workers', type=int, default=None, help='並列数（既定はCPU数）')
+    parser.add_argument('--top-n', type=int, default=0, help='薬品ごとの最大院所数（0は制限なし）')
+    parser.add_argument('--bundle', action='store_true', help='院所別ファイルのZIPで出力する')
+    parser.add_argument('--csv', action='store_true',
+                        help='チャンク単位で処理してCSVで出力する（大きな不良在庫CSV向け）')
+    parser.add_argument('--chunksize', type=int, default=50000, help='--csv で一度に処理する行数')
+    parser.add_argument('--summary', help='結果の概要をJSONで書き出すパス')
+    parser.add_argument('--quiet', action='store_true', help='段階ごとの構造化ログを出力しない')
+    args = parser.parse_args(argv)
+
+    if args.csv and args.bundle:
+        parser.error('--csv と --bundle は同時に指定できません')
+    if args.quiet:
+        logging.getLogger('pipeline').setLevel(logging.WARNING)
+
+    if args.manifest:
+        sets = load_manifest(args.manifest, args.purchase, args.master)
+    elif args.directory:
+        if not args.purchase or not args.master:
+            parser.error('ディレクトリを指定する場合は --purchase と --master が必要です')
+        sets = scan_directory(args.directory, args.purchase, args.master)
+    else:
+        parser.error('ディレクトリまたは --manifest を指定してください')
+
+    incomplete = [entry['name'] for entry in sets if not all(entry[k] for k in ('purchase', 'inventory', 'master'))]
+    if incomplete:
+        parser.error(f"ファイルが不足している組があります: {', '.join(incomplete)}")
+    if not sets:
+        parser.error('処理する組がありません')
+
+    start = time.perf_counter()
+    results = run_batch(
+        sets, args.out, max_workers=args.workers, top_n=args.top_n or None,
+        bundle=args.bundle, quiet=args.quiet, as_csv=args.csv, chunksize=args.chunksize
+    )
+    elapsed = time.perf_counter() - start
+
+    failures = [result for result in results if result['status'] != 'ok']
+    for result in results:
+        if result['status'] == 'ok':
+            print(f"OK   {result['name']}: {result['rows']}件 {result['seconds']:.2f}秒 -> {result['output']}")
+        else:
+            print(f"NG   {result['name']}: {result['error']}")
+    print(f"{len(results)}組中 成功 {len(results) - len(failures)}組 / 失敗 {len(failures)}組（{elapsed:.2f}秒）")
+
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(
+                {'seconds': round(elapsed, 3), 'results': results},
+                f, ensure_ascii=False, indent=2
+            )
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""generate_excel のベンチマーク
+
+院所ごとに df をフィルタしセル単位で書式を設定していた従来の実装と、
+groupby と名前付きスタイルを使う現在の実装の処理時間を比較する。
+
+    python benchmarks/bench_generate_excel.py --rows 100000 --institutions 300
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from openpyxl.styles import Border, Side
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from file_processor import FileProcessor  # noqa: E402
+
+
+def make_result_df(rows, institutions, seed=0):
+    rng = np.random.default_rng(seed)
+    institution_ids = rng.integers(0, institutions, rows)
+    df = pd.DataFrame({
+        '品名・規格': [f"薬品{i}錠 {i % 50}mg" for i in rng.integers(0, 5000, rows)],
+        '在庫量': rng.integers(1, 500, rows).astype(str),
+        '単位': rng.choice(['錠', 'カプセル', 'mL', '包'], rows),
+        '新薬品ｺｰﾄﾞ': rng.integers(100000, 999999, rows).astype(str),
+        '使用期限': pd.Timestamp('2026-01-01')
+                    + pd.to_timedelta(rng.integers(0, 720, rows), unit='D'),
+        'ロット番号': [f"L{i:06d}" for i in rng.integers(0, 999999, rows)],
+        '法人名': [f"法人{i % 40}" for i in institution_ids],
+        '院所名': [f"院所{i}" for i in institution_ids],
+    })
+    df['使用期限'] = df['使用期限'].astype(str)
+    return df.sort_values(['法人名', '院所名'])
+
+
+def legacy_generate_excel(df):
+    """院所ごとのフィルタとセル単位の書式設定を行う従来の実装"""
+    excel_buffer = io.BytesIO()
+    thin_border = Border(
+        left=Side(style='thin'), right=Side(style='thin'),
+        top=Side(style='thin'), bottom=Side(style='thin')
+    )
+    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
+        for name in df['院所名'].unique():
+            if not (pd.notna(name) and str(name).strip()):
+                continue
+            sheet_name = FileProcessor._clean_sheet_name(str(name))
+            sheet_df = df[df['院所名'] == name].copy()
+            houjin_name = sheet_df['法人名'].iloc[0]
+            display_df = sheet_df.drop(['法人名', '院所名'], axis=1)
+            display_df.insert(display_df.columns.get_loc('ロット番号') + 1, '引取り可能数', '')
+            header_df = pd.DataFrame([
+                ['不良在庫引き取り依頼'], [''],
+                ['{} {} 御中'.format(str(houjin_name).strip(), str(name).strip())], [''],
+                ['下記の不良在庫につきまして、引き取りのご検討を賜れますと幸いです。どうぞよろしくお願いいたします。'], ['']
+            ])
+            header_df.to_excel(writer, sheet_name=sheet_name, index=False, header=False)
+            display_df.to_excel(writer, sheet_name=sheet_name, startrow=6, index=False)
+
+            worksheet = writer.sheets[sheet_name]
+            worksheet.column_dimensions['A'].width = 35
+            for col in ['B', 'C', 'D', 'E', 'F', 'G']:
+                worksheet.column_dimensions[col].width = 17
+            for row in worksheet.iter_rows(min_row=7):
+                for cell in row:
+                    cell.border = thin_border
+            for row in range(1, worksheet.max_row + 1):
+                worksheet.row_dimensions[row].height = 30
+            for row in worksheet.iter_rows():
+                for cell in row:
+                    cell.font = cell.font.copy(size=14)
+            worksheet['A1'].font = worksheet['A1'].font.copy(size=16)
+            worksheet['A3'].font = worksheet['A3'].font.copy(size=14, bold=True)
+            worksheet.page_setup.orientation = worksheet.ORIENTATION_LANDSCAPE
+            worksheet.print_title_rows = '1:7'
+            worksheet.page_setup.fitToPage = True
+            worksheet.page_setup.fitToHeight = 0
+            worksheet.page_setup.fitToWidth = 1
+    excel_buffer.seek(0)
+    return excel_buffer
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--institutions', type=int, default=300)
+    parser.add_argument('--skip-legacy', action='store_true', help='従来実装の計測を省略する')
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore', DeprecationWarning)
+    df = make_result_df(args.rows, args.institutions)
+    print(f"rows={len(df)} institutions={df['院所名'].nunique()}")
+
+    results = {}
+    if not args.skip_legacy:
+        results['legacy'], _ = timed(legacy_generate_excel, df)
+    results['write_only'], buffer = timed(FileProcessor.generate_excel, df)
+    results['in_memory'], _ = timed(FileProcessor.generate_excel, df, write_only=False)
+
+    for name, seconds in results.items():
+        print(f"{name:>10}: {seconds:8.2f}s")
+    if 'legacy' in results:
+        print(f"speedup (write_only): {results['legacy'] / results['write_only']:.1f}x")
+    print(f"output size: {len(buffer.getvalue()) / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
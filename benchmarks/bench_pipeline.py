@@ -0,0 +1,154 @@
+"""FileProcessor の処理段階ごとのベンチマーク
+
+合成データ（generate_data.py）を規模別に生成し、read_excel・read_csv・
+process_data・generate_excel などの処理時間とメモリを計測して
+JSON で出力する。バージョン間の比較には出力ファイル同士を比べる。
+
+    python benchmarks/bench_pipeline.py --sizes 1000 10000 100000 \\
+        --institutions 10 100 --output results.json
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from file_processor import FileProcessor  # noqa: E402
+from generate_data import generate  # noqa: E402
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(__file__), capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def _upload(path):
+    # Streamlit の UploadedFile と同様に getvalue() を持つオブジェクト
+    with open(path, 'rb') as f:
+        return io.BytesIO(f.read())
+
+
+def measure(func, trace_memory):
+    """func の実行時間と、メモリ使用量（tracemalloc のピークまたは最大RSS）を返す"""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func()
+    finally:
+        seconds = time.perf_counter() - start
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+    metrics = {
+        'seconds': round(seconds, 4),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if peak is not None:
+        metrics['peak_mb'] = round(peak, 1)
+    return metrics, result
+
+
+def run_case(paths, trace_memory, skip_read_excel):
+    steps = {}
+    if not skip_read_excel:
+        steps['read_excel'], _ = measure(
+            lambda: FileProcessor.read_excel(_upload(paths['purchase_history'])), trace_memory
+        )
+    steps['read_purchase_history'], purchase_df = measure(
+        lambda: FileProcessor.read_purchase_history(_upload(paths['purchase_history'])), trace_memory
+    )
+    steps['read_csv_inventory'], inventory_df = measure(
+        lambda: FileProcessor.read_csv(_upload(paths['inventory']), file_type='inventory'), trace_memory
+    )
+    steps['read_csv_yj_code'], yj_code_df = measure(
+        lambda: FileProcessor.read_csv(_upload(paths['yj_code'])), trace_memory
+    )
+    steps['process_data'], result_df = measure(
+        lambda: FileProcessor.process_data(purchase_df, inventory_df, yj_code_df), trace_memory
+    )
+    steps['generate_excel'], _ = measure(
+        lambda: FileProcessor.generate_excel(result_df), trace_memory
+    )
+    rows = {
+        'purchase_history': len(purchase_df),
+        'inventory': len(inventory_df),
+        'yj_code': len(yj_code_df),
+        'result': len(result_df),
+        'sheets': int(result_df.loc[result_df['院所名'] != '', '院所名'].nunique()),
+    }
+    return steps, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FileProcessor のベンチマーク')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help='不良在庫CSVの行数（購入履歴はその2倍、XLSXの最大行数まで）')
+    parser.add_argument('--institutions', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='tracemalloc でピークメモリを計測する（処理は遅くなる）')
+    parser.add_argument('--skip-read-excel', action='store_true',
+                        help='全列を読み込む read_excel の計測を省略する')
+    parser.add_argument('--data-dir', help='生成データの保存先（既定は一時ディレクトリ）')
+    parser.add_argument('--output', help='結果JSONの出力先（既定は標準出力）')
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore')
+    logging.getLogger('pipeline').setLevel(logging.WARNING)
+
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'trace_memory': args.trace_memory,
+        'cases': [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        base_dir = args.data_dir or tmp_dir
+        for size in args.sizes:
+            for institutions in args.institutions:
+                case_dir = os.path.join(base_dir, f"rows{size}_inst{institutions}")
+                paths = generate(case_dir, inventory_rows=size, institutions=institutions, seed=args.seed)
+                steps, rows = run_case(paths, args.trace_memory, args.skip_read_excel)
+                results['cases'].append({
+                    'inventory_rows': size,
+                    'institutions': institutions,
+                    'rows': rows,
+                    'steps': steps,
+                })
+                summary = ' '.join(f"{name}={m['seconds']:.2f}s" for name, m in steps.items())
+                print(f"rows={size} institutions={institutions} {summary}", file=sys.stderr)
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""ベンチマーク用の合成データ生成
+
+実データを使わずに性能を計測できるよう、3種類の入力ファイルを
+実際の形式に合わせて生成する。
+
+- OMEC他院所 (XLSX)
+- 不良在庫データ (CSV, CP932, 先頭7行の前置き付き)
+- 在庫金額 (CSV, CP932)
+
+    python benchmarks/generate_data.py --out /tmp/bench --inventory-rows 100000 \\
+        --purchase-rows 200000 --institutions 300
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+DRUG_BASES = [
+    'アムロジピン', 'ロスバスタチン', 'メトホルミン', 'ランソプラゾール', 'ロキソプロフェン',
+    'レバミピド', 'カンデサルタン', 'オルメサルタン', 'エソメプラゾール', 'ファモチジン',
+    'セレコキシブ', 'ビソプロロール', 'クロピドグレル', 'モンテルカスト', 'フェブキソスタット',
+    'シタグリプチン', 'トラマドール', 'プレガバリン', 'ゾルピデム', 'エチゾラム',
+]
+FORMS = [('錠', '錠', 'F'), ('カプセル', 'カプセル', 'M'), ('OD錠', '錠', 'F'), ('散', 'g', 'B'), ('シロップ', 'mL', 'Q')]
+MAKERS = ['「サワイ」', '「トーワ」', '「日医工」', '「明治」', '「ＤＳＥＰ」', '']
+STRENGTHS = ['2.5mg', '5mg', '10mg', '20mg', '25mg', '50mg', '100mg']
+
+# XLSXの1シートの最大行数（見出し行を除く）。FileProcessor は先頭のシートのみ読むため
+# 購入履歴は複数シートに分けずにこの行数までとする
+XLSX_MAX_DATA_ROWS = 1048576 - 1
+
+
+def make_drug_catalog(n_drugs, rng):
+    """薬品名・ＹＪコード・単位・新薬品ｺｰﾄﾞの一覧を作成する"""
+    base = rng.integers(0, len(DRUG_BASES), n_drugs)
+    form = rng.integers(0, len(FORMS), n_drugs)
+    maker = rng.integers(0, len(MAKERS), n_drugs)
+    strength = rng.integers(0, len(STRENGTHS), n_drugs)
+
+    names, yj_codes, units = [], [], []
+    for i in range(n_drugs):
+        form_name, unit, form_code = FORMS[form[i]]
+        # 同名にならないよう連番を規格に含める
+        names.append(f"{DRUG_BASES[base[i]]}{form_name}{STRENGTHS[strength[i]]}{MAKERS[maker[i]]} {i}")
+        yj_codes.append(f"{1100 + base[i] * 37 % 8900:04d}{i % 1000:03d}{form_code}{i % 10}{i // 10 % 1000:03d}")
+        units.append(unit)
+    return pd.DataFrame({
+        '薬品名': names,
+        'ＹＪコード': yj_codes,
+        '単位': units,
+        '新薬品ｺｰﾄﾞ': 100000 + np.arange(n_drugs),
+    })
+
+
+def make_institutions(n_institutions):
+    n_corporations = max(1, n_institutions // 8)
+    return [
+        (f"医療法人 合成会{i % n_corporations:03d}", f"合成薬局 第{i:04d}店")
+        for i in range(n_institutions)
+    ]
+
+
+def write_purchase_history(path, catalog, institutions, rows, rng):
+    """OMEC他院所XLSXを書き込み専用モードで生成する"""
+    drug_idx = rng.zipf(1.3, rows) % len(catalog)
+    inst_idx = rng.integers(0, len(institutions), rows)
+    days = rng.integers(0, 365, rows)
+    quantities = rng.integers(1, 300, rows)
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('他院所')
+    worksheet.append(['購入日', '法人名', '院所名', '厚労省CD', '品名・規格', '新薬品ｺｰﾄﾞ', '数量', '単価'])
+    start = pd.Timestamp('2025-01-01')
+    names = catalog['薬品名'].to_numpy()
+    codes = catalog['ＹＪコード'].to_numpy()
+    new_codes = catalog['新薬品ｺｰﾄﾞ'].to_numpy()
+    for i in range(rows):
+        d = drug_idx[i]
+        corporation, institution = institutions[inst_idx[i]]
+        worksheet.append([
+            (start + pd.Timedelta(days=int(days[i]))).to_pydatetime(),
+            corporation,
+            institution,
+            codes[d],
+            names[d].rsplit(' ', 1)[0],
+            int(new_codes[d]),
+            int(quantities[i]),
+            round(float(rng.uniform(5, 500)), 1),
+        ])
+    workbook.save(path)
+
+
+def write_inventory_csv(path, catalog, rows, rng):
+    """不良在庫CSV（先頭7行の前置き付き、CP932）を生成する"""
+    drug_idx = rng.integers(0, len(catalog), rows)
+    # 一部は空の薬品名・0以下の在庫量・不正な期限を含める
+    names = catalog['薬品名'].to_numpy()[drug_idx].astype(object)
+    names[rng.random(rows) < 0.01] = ''
+    quantities = rng.integers(-2, 500, rows)
+    expiry = (pd.Timestamp('2026-01-01') + pd.to_timedelta(rng.integers(0, 900, rows), unit='D')).strftime('%Y/%m/%d')
+    expiry = expiry.to_numpy().astype(object)
+    expiry[rng.random(rows) < 0.005] = '不明'
+
+    df = pd.DataFrame({
+        'JANコード': rng.integers(10**12, 10**13 - 1, rows),
+        '薬品名': names,
+        '在庫量': quantities,
+        '使用期限': expiry,
+        'ロット番号': [f"L{v:07d}" for v in rng.integers(0, 10**7, rows)],
+        '薬価': np.round(rng.uniform(5, 500, rows), 1),
+    })
+    preamble = [
+        '不良在庫一覧',
+        '出力日,2026/10/01',
+        '店舗,合成薬局 本店',
+        '対象,使用期限180日以内',
+        '',
+        '※このファイルはベンチマーク用の合成データです',
+        '',
+    ]
+    with open(path, 'w', encoding='cp932', newline='') as f:
+        f.write('\r\n'.join(preamble) + '\r\n')
+        df.to_csv(f, index=False, lineterminator='\r\n')
+
+
+def write_master_csv(path, catalog, rng):
+    """在庫金額CSV（CP932）を生成する"""
+    df = pd.DataFrame({
+        '薬品名': catalog['薬品名'],
+        'ＹＪコード': catalog['ＹＪコード'],
+        '単位': catalog['単位'],
+        '在庫数': rng.integers(0, 1000, len(catalog)),
+        '在庫金額': np.round(rng.uniform(0, 100000, len(catalog)), 0).astype(int),
+    })
+    df.to_csv(path, index=False, encoding='cp932', lineterminator='\r\n')
+
+
+def generate(out_dir, inventory_rows=10000, purchase_rows=None, institutions=100,
+             drugs=None, seed=0):
+    """3種類の入力ファイルを out_dir に生成し、パスを返す
+
+    購入履歴の行数の既定値は在庫行数の2倍（XLSXの最大行数まで）。
+    """
+    rng = np.random.default_rng(seed)
+    purchase_rows = purchase_rows or min(inventory_rows * 2, XLSX_MAX_DATA_ROWS)
+    if purchase_rows > XLSX_MAX_DATA_ROWS:
+        raise ValueError(f"購入履歴の行数はXLSXの上限の{XLSX_MAX_DATA_ROWS}行までです: {purchase_rows}")
+    drugs = drugs or max(200, min(20000, inventory_rows // 10))
+
+    os.makedirs(out_dir, exist_ok=True)
+    catalog = make_drug_catalog(drugs, rng)
+    paths = {
+        'purchase_history': os.path.join(out_dir, 'omec_purchase_history.xlsx'),
+        'inventory': os.path.join(out_dir, 'dead_stock.csv'),
+        'yj_code': os.path.join(out_dir, 'stock_value.csv'),
+    }
+    write_purchase_history(paths['purchase_history'], catalog, make_institutions(institutions), purchase_rows, rng)
+    write_inventory_csv(paths['inventory'], catalog, inventory_rows, rng)
+    write_master_csv(paths['yj_code'], catalog, rng)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ベンチマーク用の合成データを生成する')
+    parser.add_argument('--out', required=True, help='出力ディレクトリ')
+    parser.add_argument('--inventory-rows', type=int, default=10000)
+    parser.add_argument('--purchase-rows', type=int, default=None,
+                        help=f'既定は在庫行数の2倍（最大 {XLSX_MAX_DATA_ROWS}）')
+    parser.add_argument('--institutions', type=int, default=100)
+    parser.add_argument('--drugs', type=int, default=None, help='既定は在庫行数の1/10（200～20000）')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.purchase_rows and args.purchase_rows > XLSX_MAX_DATA_ROWS:
+        parser.error(f'--purchase-rows はXLSXの上限の{XLSX_MAX_DATA_ROWS}行までです')
+
+    paths = generate(
+        args.out,
+        inventory_rows=args.inventory_rows,
+        purchase_rows=args.purchase_rows,
+        institutions=args.institutions,
+        drugs=args.drugs,
+        seed=args.seed,
+    )
+    for kind, path in paths.items():
+        print(f"{kind}: {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MiB)")
+
+
+if __name__ == '__main__':
+    main()
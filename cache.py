@@ -0,0 +1,105 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+class ResultCache:
+    """アップロード内容のハッシュをキーにした LRU キャッシュ
+
+    Streamlit の再実行ごとに同じファイルを読み直さないよう、
+    読み込み済み DataFrame・処理結果・生成済み Excel を保持する。
+    エントリ数と推定メモリ量の両方で上限を設け、古いものから破棄する。
+    """
+
+    def __init__(self, max_entries=64, max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def file_key(file_bytes, file_type):
+        digest = hashlib.sha256(file_bytes).hexdigest()
+        return f"{file_type}:{digest}"
+
+    @staticmethod
+    def combine_keys(*keys):
+        return hashlib.sha256('|'.join(keys).encode()).hexdigest()
+
+    @staticmethod
+    def _estimate_size(value):
+        if isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(index=True, deep=True).sum())
+        if isinstance(value, (bytes, bytearray)):
+            return len(value)
+        return 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        size = self._estimate_size(value)
+        # 単体で上限を超えるものは保持しない
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._total_bytes += size
+            while (len(self._entries) > self.max_entries
+                   or self._total_bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """プロセス全体で共有するキャッシュを返す（全セッション共通）"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ResultCache(
+                max_entries=int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 64)),
+                max_bytes=int(os.environ.get('RESULT_CACHE_MAX_MB', 512)) * 1024 * 1024
+            )
+        return _shared_cache
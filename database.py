@@ -1,20 +1,149 @@
+import io
 import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+from drug_matcher import normalize_name
+from file_processor import FileProcessor
+from instrumentation import stage
+
+
+class ConnectionPool:
+    """プロセス全体で共有するコネクションプール
+
+    ThreadedConnectionPool は上限に達すると例外を送出するため、
+    セマフォで空きを待つようにし、利用状況の計測値を保持する。
+    """
+
+    def __init__(self, minconn, maxconn, **connect_kwargs):
+        self.maxconn = maxconn
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.total_checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+
+    @contextmanager
+    def connection(self):
+        start = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+        try:
+            self._slots.acquire()
+            try:
+                conn = self._pool.getconn()
+            except Exception:
+                self._slots.release()
+                raise
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.total_checkout_seconds += elapsed
+            self.max_checkout_seconds = max(self.max_checkout_seconds, elapsed)
+
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            # 切断されたコネクションはプールに戻さず破棄する
+            self._pool.putconn(conn, close=bool(conn.closed))
+            self._slots.release()
+
+    def metrics(self):
+        with self._lock:
+            average = self.total_checkout_seconds / self.checkouts if self.checkouts else 0.0
+            return {
+                'max_connections': self.maxconn,
+                'in_use': self.in_use,
+                'waiting': self.waiting,
+                'checkouts': self.checkouts,
+                'avg_checkout_ms': average * 1000,
+                'max_checkout_ms': self.max_checkout_seconds * 1000,
+            }
+
+    def close(self):
+        self._pool.closeall()
+
+
+# inventoryテーブルの列と処理結果の列の対応
+INVENTORY_COLUMN_MAP = {
+    'yj_code': 'ＹＪコード',
+    'product_name': '品名・規格',
+    'quantity': '在庫量',
+    'expiry_date': '使用期限',
+    'corporation': '法人名',
+    'pharmacy_id': '院所名',
+}
+
+# 保存済みデータの閲覧・出力で返す列（キーセットページングに id と uploaded_at を使用）
+INVENTORY_BROWSE_COLUMNS = [
+    'id', 'uploaded_at', 'corporation', 'pharmacy_id', 'yj_code',
+    'product_name', 'quantity', 'expiry_date',
+]
+INVENTORY_BROWSE_LABELS = dict(INVENTORY_COLUMN_MAP, id='ID', uploaded_at='登録日時')
+
+# COPYで一度に送信する行数
+COPY_CHUNK_ROWS = 50000
+
+_pool = None
+_master_cache = {'version': None, 'mapping': {}, 'matcher': None}
+_master_lock = threading.Lock()
+_schema_ready = False
+_init_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _init_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                int(os.environ.get('DB_POOL_MIN', 1)),
+                int(os.environ.get('DB_POOL_MAX', 10)),
+                dbname=os.environ['PGDATABASE'],
+                user=os.environ['PGUSER'],
+                password=os.environ['PGPASSWORD'],
+                host=os.environ['PGHOST'],
+                port=os.environ['PGPORT']
+            )
+        return _pool
+
 
 class Database:
     def __init__(self):
-        self.conn = psycopg2.connect(
-            dbname=os.environ['PGDATABASE'],
-            user=os.environ['PGUSER'],
-            password=os.environ['PGPASSWORD'],
-            host=os.environ['PGHOST'],
-            port=os.environ['PGPORT']
-        )
-        self._create_tables()
+        self.pool = get_pool()
+        self._ensure_schema()
+
+    def _ensure_schema(self):
+        # スキーマ作成はプロセスごとに一度だけ実行する
+        global _schema_ready
+        if _schema_ready:
+            return
+        with _init_lock:
+            if not _schema_ready:
+                self._create_tables()
+                _schema_ready = True
 
     def _create_tables(self):
-        with self.conn.cursor() as cur:
+        with self.pool.connection() as conn, conn.cursor() as cur:
             # ユーザーテーブル
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -24,7 +153,7 @@ class Database:
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
-            
+
             # 在庫データテーブル
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS inventory (
@@ -37,10 +166,119 @@ class Database:
                     uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
-            self.conn.commit()
+
+            # アップロード単位のバッチテーブル（入力ファイルの内容ハッシュで重複を防止）
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS upload_batches (
+                    id SERIAL PRIMARY KEY,
+                    content_hash VARCHAR(64) UNIQUE NOT NULL,
+                    row_count INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # 登録した処理結果のキー（薬品マスタのバージョン・top_n を含む）
+            cur.execute("""
+                ALTER TABLE upload_batches ADD COLUMN IF NOT EXISTS result_key VARCHAR(64)
+            """)
+            cur.execute("""
+                ALTER TABLE inventory
+                ADD COLUMN IF NOT EXISTS batch_id INTEGER REFERENCES upload_batches(id)
+            """)
+            cur.execute("""
+                ALTER TABLE inventory ADD COLUMN IF NOT EXISTS corporation VARCHAR(200)
+            """)
+
+            # 閲覧用の索引（新しい順のキーセットページングと絞り込み）
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_inventory_uploaded_at
+                ON inventory (uploaded_at DESC, id DESC)
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_inventory_yj_code
+                ON inventory (yj_code, uploaded_at DESC, id DESC)
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_inventory_pharmacy_id
+                ON inventory (pharmacy_id, uploaded_at DESC, id DESC)
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_inventory_corporation
+                ON inventory (corporation, uploaded_at DESC, id DESC)
+            """)
+
+            # 薬品マスタ（在庫金額CSVの薬品名 → ＹＪコード・単位）
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS drug_master (
+                    product_name VARCHAR(200) PRIMARY KEY,
+                    yj_code VARCHAR(100),
+                    unit VARCHAR(50),
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_drug_master_yj_code ON drug_master (yj_code)
+            """)
+            # 正規化した薬品名（drug_matcher.normalize_name）と索引
+            cur.execute("""
+                ALTER TABLE drug_master ADD COLUMN IF NOT EXISTS normalized_name VARCHAR(200)
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_drug_master_normalized_name
+                ON drug_master (normalized_name)
+            """)
+            # 列の追加前に登録された行の正規化名を補完する（照合結果は変わらないため版は据え置き）
+            cur.execute("SELECT product_name FROM drug_master WHERE normalized_name IS NULL")
+            missing = [(name, normalize_name(name)) for name, in cur.fetchall()]
+            if missing:
+                execute_values(cur, """
+                    UPDATE drug_master SET normalized_name = data.normalized_name
+                    FROM (VALUES %s) AS data (product_name, normalized_name)
+                    WHERE drug_master.product_name = data.product_name
+                """, missing)
+
+            # 薬品マスタのバージョン（変更があるたびに加算）
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS drug_master_meta (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    version INTEGER NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cur.execute("""
+                INSERT INTO drug_master_meta (id, version) VALUES (1, 0)
+                ON CONFLICT (id) DO NOTHING
+            """)
+
+            # バックグラウンド処理のジョブ（状態と結果ファイルの保存先）
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS processing_jobs (
+                    job_id VARCHAR(32) PRIMARY KEY,
+                    username VARCHAR(100) NOT NULL,
+                    status VARCHAR(20) NOT NULL,
+                    message TEXT,
+                    result_path TEXT,
+                    result_key VARCHAR(64),
+                    row_count INTEGER,
+                    saved_rows INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            """)
+            cur.execute("""
+                ALTER TABLE processing_jobs ADD COLUMN IF NOT EXISTS report_path TEXT
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_processing_jobs_username
+                ON processing_jobs (username, created_at DESC)
+            """)
+            conn.commit()
+
+    def pool_metrics(self):
+        return self.pool.metrics()
 
     def verify_user(self, username, password_hash):
-        with self.conn.cursor(cursor_factory=DictCursor) as cur:
+        with self.pool.connection() as conn, conn.cursor(cursor_factory=DictCursor) as cur:
             cur.execute(
                 "SELECT * FROM users WHERE username = %s AND password_hash = %s",
                 (username, password_hash)
@@ -49,27 +287,336 @@ class Database:
 
     def create_user(self, username, password_hash):
         try:
-            with self.conn.cursor() as cur:
+            with self.pool.connection() as conn, conn.cursor() as cur:
                 cur.execute(
                     "INSERT INTO users (username, password_hash) VALUES (%s, %s)",
                     (username, password_hash)
                 )
-                self.conn.commit()
+                conn.commit()
                 return True
         except psycopg2.Error:
-            self.conn.rollback()
             return False
 
-    def save_inventory(self, inventory_data):
-        with self.conn.cursor() as cur:
-            cur.executemany("""
-                INSERT INTO inventory 
-                (yj_code, product_name, quantity, expiry_date, pharmacy_id)
-                VALUES (%s, %s, %s, %s, %s)
-            """, inventory_data)
-            self.conn.commit()
-
-    def get_inventory(self):
-        with self.conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("SELECT * FROM inventory ORDER BY uploaded_at DESC")
-            return cur.fetchall()
+    def save_inventory(self, result_df, content_hash, result_key):
+        """処理結果を COPY で一括登録し、登録行数を返す
+
+        content_hash は入力ファイル（購入履歴・不良在庫）のみの内容ハッシュで、
+        登録済みの場合は同じアップロードとみなす。result_key（薬品マスタの
+        バージョン・top_n を含む処理結果のキー）も同じなら何もせず None を返し、
+        異なる場合はそのアップロードの登録行を同じトランザクションで置き換える。
+        """
+        data = result_df[list(INVENTORY_COLUMN_MAP.values())]
+        columns = ', '.join(list(INVENTORY_COLUMN_MAP) + ['batch_id'])
+
+        with stage('db_save', rows_in=len(data)) as record:
+            with self.pool.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO upload_batches (content_hash, result_key, row_count)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (content_hash) DO UPDATE
+                    SET result_key = EXCLUDED.result_key,
+                        row_count = EXCLUDED.row_count,
+                        created_at = CURRENT_TIMESTAMP
+                    WHERE upload_batches.result_key IS DISTINCT FROM EXCLUDED.result_key
+                    RETURNING id, (xmax = 0) AS inserted
+                """, (content_hash, result_key, len(data)))
+                row = cur.fetchone()
+                if row is None:
+                    conn.rollback()
+                    record['skipped'] = True
+                    return None
+                batch_id, inserted = row
+                if not inserted:
+                    # 薬品マスタ・top_n が変わった再アップロードは前回の登録行を置き換える
+                    cur.execute("DELETE FROM inventory WHERE batch_id = %s", (batch_id,))
+                    record['replaced'] = cur.rowcount
+
+                # 一定行数ごとにCSVへ変換してCOPYで送信する
+                for start in range(0, len(data), COPY_CHUNK_ROWS):
+                    buffer = io.StringIO()
+                    data.iloc[start:start + COPY_CHUNK_ROWS].assign(batch_id=batch_id).to_csv(
+                        buffer, index=False, header=False
+                    )
+                    buffer.seek(0)
+                    cur.copy_expert(
+                        f"COPY inventory ({columns}) FROM STDIN WITH (FORMAT csv)",
+                        buffer
+                    )
+                conn.commit()
+                record['rows_out'] = len(data)
+                return len(data)
+
+    def update_drug_master(self, yj_code_df):
+        """在庫金額CSVの内容を薬品マスタに反映し、追加・変更された行数を返す"""
+        master = yj_code_df[['薬品名', 'ＹＪコード', '単位']].fillna('').astype(str)
+        master['薬品名'] = master['薬品名'].str.strip()
+        master = master[master['薬品名'] != ''].drop_duplicates('薬品名', keep='last')
+        master['正規化名'] = master['薬品名'].map(normalize_name)
+
+        with stage('drug_master_update', rows_in=len(master)) as record:
+            with self.pool.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TEMP TABLE drug_master_staging (
+                        product_name VARCHAR(200),
+                        yj_code VARCHAR(100),
+                        unit VARCHAR(50),
+                        normalized_name VARCHAR(200)
+                    ) ON COMMIT DROP
+                """)
+                buffer = io.StringIO()
+                master.to_csv(buffer, index=False, header=False)
+                buffer.seek(0)
+                cur.copy_expert(
+                    "COPY drug_master_staging (product_name, yj_code, unit, normalized_name) "
+                    "FROM STDIN WITH (FORMAT csv)",
+                    buffer
+                )
+
+                # 内容が変わった行のみ更新する
+                cur.execute("""
+                    INSERT INTO drug_master (product_name, yj_code, unit, normalized_name)
+                    SELECT product_name, yj_code, unit, normalized_name FROM drug_master_staging
+                    ON CONFLICT (product_name) DO UPDATE
+                    SET yj_code = EXCLUDED.yj_code,
+                        unit = EXCLUDED.unit,
+                        normalized_name = EXCLUDED.normalized_name,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE drug_master.yj_code IS DISTINCT FROM EXCLUDED.yj_code
+                       OR drug_master.unit IS DISTINCT FROM EXCLUDED.unit
+                       OR drug_master.normalized_name IS DISTINCT FROM EXCLUDED.normalized_name
+                """)
+                changed = cur.rowcount
+                if changed:
+                    cur.execute("""
+                        UPDATE drug_master_meta
+                        SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+                        WHERE id = 1
+                    """)
+                conn.commit()
+                record['rows_out'] = changed
+                return changed
+
+    def get_drug_master_version(self):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT version FROM drug_master_meta WHERE id = 1")
+            row = cur.fetchone()
+            conn.commit()
+            return row[0] if row else 0
+
+    def get_drug_master_mapping(self):
+        """薬品名 → (ＹＪコード, 単位) の対応とマスタのバージョンを返す
+
+        対応表はプロセス内で保持し、マスタのバージョンが変わった場合のみ読み直す。
+        """
+        version = self.get_drug_master_version()
+        with _master_lock:
+            if _master_cache['version'] == version:
+                return version, _master_cache['mapping']
+
+            with self.pool.connection() as conn, conn.cursor() as cur:
+                # 行より先にバージョンを読み、読み込み中の更新は次回に反映させる
+                cur.execute("SELECT version FROM drug_master_meta WHERE id = 1")
+                row = cur.fetchone()
+                version = row[0] if row else 0
+                cur.execute("SELECT product_name, yj_code, unit FROM drug_master")
+                mapping = {
+                    name: (yj_code or '', unit or '')
+                    for name, yj_code, unit in cur.fetchall()
+                }
+                conn.commit()
+
+            _master_cache['version'] = version
+            _master_cache['mapping'] = mapping
+            _master_cache['matcher'] = None
+            return version, mapping
+
+    def get_drug_master_matcher(self):
+        """薬品マスタの照合エンジン（正規化・n-gram索引）とバージョンを返す
+
+        索引はマスタのバージョンごとに一度だけ作成する。
+        """
+        version, mapping = self.get_drug_master_mapping()
+        with _master_lock:
+            matcher = _master_cache['matcher']
+            if _master_cache['version'] == version and matcher is not None:
+                return version, matcher
+            matcher = FileProcessor.build_drug_matcher(mapping)
+            if _master_cache['version'] == version:
+                _master_cache['matcher'] = matcher
+            return version, matcher
+
+    @staticmethod
+    def _inventory_conditions(corporation=None, pharmacy_id=None, yj_code=None,
+                              expiry_from=None, expiry_to=None):
+        # 絞り込み条件を WHERE 句の条件とパラメータに変換する
+        conditions, params = [], []
+        for column, value in [('corporation', corporation), ('pharmacy_id', pharmacy_id), ('yj_code', yj_code)]:
+            if value:
+                conditions.append(f"{column} = %s")
+                params.append(value)
+        if expiry_from:
+            conditions.append("expiry_date >= %s")
+            params.append(expiry_from)
+        if expiry_to:
+            conditions.append("expiry_date <= %s")
+            params.append(expiry_to)
+        return conditions, params
+
+    def get_inventory(self, after=None, limit=100, **filters):
+        """保存済みの在庫データを新しい順に1ページ分返す
+
+        ページ送りは (uploaded_at, id) のキーセットで行うため、件数が増えても
+        索引を辿る範囲は1ページ分で済む。after には前のページが返した
+        next_cursor を渡す。filters は corporation・pharmacy_id・yj_code・
+        expiry_from・expiry_to。(行のリスト, next_cursor) を返し、最後の
+        ページでは next_cursor が None になる。
+        """
+        conditions, params = self._inventory_conditions(**filters)
+        if after is not None:
+            conditions.append("(uploaded_at, id) < (%s, %s)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        with self.pool.connection() as conn, conn.cursor(cursor_factory=DictCursor) as cur:
+            # 次のページの有無を判定するため1件多く取得する
+            cur.execute(f"""
+                SELECT {', '.join(INVENTORY_BROWSE_COLUMNS)} FROM inventory
+                {where}
+                ORDER BY uploaded_at DESC, id DESC
+                LIMIT %s
+            """, params + [limit + 1])
+            rows = cur.fetchall()
+            conn.commit()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = (rows[-1]['uploaded_at'], rows[-1]['id'])
+        return rows, next_cursor
+
+    def iter_inventory(self, batch_size=10000, **filters):
+        """保存済みの在庫データをサーバー側カーソルで batch_size 行ずつ DataFrame で返す"""
+        conditions, params = self._inventory_conditions(**filters)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        with self.pool.connection() as conn:
+            # 名前付きカーソルは結果をサーバー側に保持し、少しずつ取得する
+            with conn.cursor(name='inventory_export') as cur:
+                cur.itersize = batch_size
+                cur.execute(f"""
+                    SELECT {', '.join(INVENTORY_BROWSE_COLUMNS)} FROM inventory
+                    {where}
+                    ORDER BY uploaded_at DESC, id DESC
+                """, params)
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield pd.DataFrame(rows, columns=INVENTORY_BROWSE_COLUMNS)
+            conn.commit()
+
+    def export_inventory_csv(self, output, batch_size=10000, **filters):
+        """絞り込んだ保存済みデータを output（テキストのファイルオブジェクト）に
+        CSVで逐次書き出し、行数を返す"""
+        total_rows = 0
+        for chunk in self.iter_inventory(batch_size=batch_size, **filters):
+            chunk.rename(columns=INVENTORY_BROWSE_LABELS).to_csv(output, index=False, header=total_rows == 0)
+            total_rows += len(chunk)
+        if total_rows == 0:
+            pd.DataFrame(columns=INVENTORY_BROWSE_COLUMNS).rename(columns=INVENTORY_BROWSE_LABELS).to_csv(
+                output, index=False
+            )
+        return total_rows
+
+    def create_job(self, job_id, username):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO processing_jobs (job_id, username, status) VALUES (%s, %s, 'queued')",
+                (job_id, username)
+            )
+            conn.commit()
+
+    def start_job(self, job_id):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE processing_jobs SET status = 'running', started_at = CURRENT_TIMESTAMP
+                WHERE job_id = %s
+            """, (job_id,))
+            conn.commit()
+
+    def finish_job(self, job_id, result_path, report_path, result_key, row_count, saved_rows):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE processing_jobs
+                SET status = 'done', result_path = %s, report_path = %s, result_key = %s,
+                    row_count = %s, saved_rows = %s, finished_at = CURRENT_TIMESTAMP
+                WHERE job_id = %s
+            """, (result_path, report_path, result_key, row_count, saved_rows, job_id))
+            conn.commit()
+
+    def fail_job(self, job_id, message):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE processing_jobs
+                SET status = 'failed', message = %s, finished_at = CURRENT_TIMESTAMP
+                WHERE job_id = %s
+            """, (message, job_id))
+            conn.commit()
+
+    def fail_interrupted_jobs(self):
+        """プロセスの再起動で中断された（待機中・実行中のまま残った）ジョブを失敗扱いにする"""
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE processing_jobs
+                SET status = 'failed', message = 'サーバーの再起動により中断されました',
+                    finished_at = CURRENT_TIMESTAMP
+                WHERE status IN ('queued', 'running')
+            """)
+            conn.commit()
+            return cur.rowcount
+
+    def delete_expired_jobs(self, username, keep, ttl_hours):
+        """完了・失敗したジョブのうち、利用者ごとの新しい keep 件に含まれないもの、
+        または ttl_hours 時間より前に終了したもの（全利用者）を削除する
+
+        削除したジョブの (結果ファイル, ダウンロード用ファイル) の保存先を返す。
+        """
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                DELETE FROM processing_jobs
+                WHERE status IN ('done', 'failed')
+                  AND (
+                      finished_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'
+                      OR (
+                          username = %s
+                          AND job_id NOT IN (
+                              SELECT job_id FROM processing_jobs WHERE username = %s
+                              ORDER BY created_at DESC LIMIT %s
+                          )
+                      )
+                  )
+                RETURNING result_path, report_path
+            """, (ttl_hours, username, username, keep))
+            rows = cur.fetchall()
+            conn.commit()
+            return rows
+
+    def get_job(self, job_id, username):
+        with self.pool.connection() as conn, conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute(
+                "SELECT * FROM processing_jobs WHERE job_id = %s AND username = %s",
+                (job_id, username)
+            )
+            row = cur.fetchone()
+            conn.commit()
+            return dict(row) if row else None
+
+    def list_jobs(self, username, limit=10):
+        with self.pool.connection() as conn, conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute("""
+                SELECT * FROM processing_jobs WHERE username = %s
+                ORDER BY created_at DESC LIMIT %s
+            """, (username, limit))
+            rows = cur.fetchall()
+            conn.commit()
+            return [dict(row) for row in rows]
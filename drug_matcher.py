@@ -0,0 +1,148 @@
+import re
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+# 照合方法
+MATCH_EXACT = '完全一致'
+MATCH_NORMALIZED = '正規化一致'
+MATCH_SIMILAR = '類似一致'
+MATCH_NONE = '未一致'
+
+# NFKC の後も表記揺れとして残る記号（括弧・中黒など）は比較時に除去する
+_REMOVE_CHARS = str.maketrans('', '', '「」『』【】〔〕()[]{}<>"\'・,、')
+_UNIT_ALIASES = [
+    ('マイクログラム', 'μg'),
+    ('ミリグラム', 'mg'),
+    ('ミリリットル', 'ml'),
+    ('グラム', 'g'),
+]
+_WHITESPACE = re.compile(r'\s+')
+_NUMBER = re.compile(r'\d+(?:\.\d+)?')
+
+
+def normalize_name(name):
+    """薬品名を比較用に正規化する（NFKC・小文字化・空白と括弧の除去・単位表記の統一）"""
+    name = unicodedata.normalize('NFKC', str(name)).lower()
+    name = _WHITESPACE.sub('', name).translate(_REMOVE_CHARS)
+    for alias, unit in _UNIT_ALIASES:
+        name = name.replace(alias, unit)
+    return name
+
+
+class DrugNameMatcher:
+    """薬品名からＹＪコード・単位を求める照合エンジン
+
+    薬品マスタ（薬品名 → (ＹＪコード, 単位)）から次の索引を一度だけ作成する。
+
+    - 薬品名そのままの完全一致
+    - 正規化した薬品名の完全一致（全角・半角、空白、括弧、単位表記の違いを吸収）
+    - 正規化した薬品名の文字 n-gram の転置索引（上記で見つからない場合の候補検索）
+
+    n-gram による候補は Dice 係数で採点し、min_score 以上かつ規格の数値
+    （5mg の 5 など）が一致するものを採用する。同点で異なるＹＪコードの
+    候補がある場合は曖昧として採用しない。
+    """
+
+    def __init__(self, mapping, ngram=2, min_score=0.8):
+        self.mapping = mapping
+        self.ngram = ngram
+        self.min_score = min_score
+
+        # 正規化後に同じ名前となり、ＹＪコードが異なるものは曖昧として除外
+        normalized = {}
+        ambiguous = set()
+        for name, entry in mapping.items():
+            key = normalize_name(name)
+            if not key:
+                continue
+            if key in normalized and normalized[key][0] != entry[0]:
+                ambiguous.add(key)
+            normalized.setdefault(key, entry)
+        for key in ambiguous:
+            del normalized[key]
+        self._normalized = normalized
+
+        # n-gram の転置索引（gram → 正規化名の番号の配列）
+        self._keys = list(normalized)
+        self._entries = [normalized[key] for key in self._keys]
+        self._numbers = [_NUMBER.findall(key) for key in self._keys]
+        postings = defaultdict(list)
+        gram_counts = np.empty(len(self._keys), dtype=np.int32)
+        for i, key in enumerate(self._keys):
+            grams = self._grams(key)
+            gram_counts[i] = len(grams)
+            for gram in grams:
+                postings[gram].append(i)
+        self._postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self._gram_counts = gram_counts
+
+    def __len__(self):
+        return len(self.mapping)
+
+    def _grams(self, key):
+        if len(key) <= self.ngram:
+            return {key}
+        return {key[i:i + self.ngram] for i in range(len(key) - self.ngram + 1)}
+
+    def _similar(self, key):
+        """n-gram の転置索引から最も類似する候補を探し、(番号, スコア) を返す"""
+        grams = self._grams(key)
+        hits = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not hits:
+            return None, 0.0
+
+        counts = np.bincount(np.concatenate(hits), minlength=len(self._keys))
+        scores = 2.0 * counts / (len(grams) + self._gram_counts)
+        candidates = np.flatnonzero(scores >= self.min_score)
+        if len(candidates) == 0:
+            return None, 0.0
+
+        numbers = _NUMBER.findall(key)
+        best = None
+        for i in candidates[np.argsort(-scores[candidates], kind='stable')]:
+            # 規格の数値が異なる薬品（5mg と 10mg など）は採用しない
+            if self._numbers[i] != numbers:
+                continue
+            if best is None:
+                best = i
+            elif scores[i] < scores[best]:
+                break
+            elif self._entries[i][0] != self._entries[best][0]:
+                return None, 0.0
+        if best is None:
+            return None, 0.0
+        return best, float(scores[best])
+
+    def lookup(self, name):
+        """1件の薬品名を照合し、(ＹＪコード, 単位, 照合方法, 照合スコア) を返す"""
+        name = str(name).strip()
+        entry = self.mapping.get(name)
+        if entry is not None:
+            return entry[0], entry[1], MATCH_EXACT, 1.0
+
+        key = normalize_name(name)
+        entry = self._normalized.get(key)
+        if entry is not None:
+            return entry[0], entry[1], MATCH_NORMALIZED, 1.0
+
+        index, score = self._similar(key) if key else (None, 0.0)
+        if index is not None:
+            yj_code, unit = self._entries[index]
+            return yj_code, unit, MATCH_SIMILAR, round(score, 3)
+        return None, None, MATCH_NONE, 0.0
+
+    def match(self, names):
+        """薬品名の Series を照合し、ＹＪコード・単位・照合方法・照合スコアの DataFrame を返す
+
+        同じ薬品名は一度だけ照合する。
+        """
+        codes, uniques = pd.factorize(names, use_na_sentinel=False)
+        resolved = pd.DataFrame(
+            [self.lookup(name) for name in uniques],
+            columns=['ＹＪコード', '単位', '照合方法', '照合スコア']
+        )
+        result = resolved.iloc[codes].set_index(names.index)
+        return result
@@ -1,14 +1,138 @@
+import numpy as np
 import pandas as pd
 import chardet
+import codecs
+import hashlib
+import importlib.util
 import io
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
-from openpyxl.styles import Border, Side
+from copy import copy
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, NamedStyle, Side
+from openpyxl.styles.fonts import DEFAULT_FONT
+from drug_matcher import DrugNameMatcher
+from instrumentation import log_error, stage
+from snapshot_store import write_atomic
 
 class FileProcessor:
+    # ファイル種別ごとに固定する文字コード（例: {'inventory': 'cp932'}）
+    PINNED_ENCODINGS = {}
+
+    # エンコーディングの判定（厳密なデコード・chardet）に使う先頭部分のバイト数
+    CHARDET_SAMPLE_SIZE = 64 * 1024
+
+    # 不良在庫CSVのうち process_data で使用する列
+    INVENTORY_COLUMNS = ['薬品名', '在庫量', '使用期限', 'ロット番号']
+
+    # OMEC他院所XLSXのうち process_data で使用する列
+    PURCHASE_COLUMNS = ['厚労省CD', '法人名', '院所名', '品名・規格', '新薬品ｺｰﾄﾞ']
+    # OMEC他院所XLSXにあれば読み込む購入日の列（購入の新しさの順位付けに使用）
+    PURCHASE_DATE_COLUMN = '購入日'
+
+    # 購入履歴索引の並び順（厚労省CD内での優先順位）
+    # 購入日の列がない場合、最終購入日はすべて欠損となり最終出現位置の順になる
+    PURCHASE_RANKINGS = {
+        'frequency': ['購入回数', '最終購入日', '最終出現位置'],
+        'recency': ['最終購入日', '最終出現位置', '購入回数'],
+    }
+
+    # 差分処理で行の変更を検出する列
+    FINGERPRINT_COLUMNS = ['薬品名', 'ロット番号', '使用期限', '在庫量']
+
+    # process_data の出力列
+    RESULT_COLUMNS = ['品名・規格', '在庫量', '単位', '新薬品ｺｰﾄﾞ', '使用期限', 'ロット番号', '法人名', '院所名', 'ＹＪコード',
+                      '照合方法', '照合スコア']
+
+    # 引き取り依頼Excelに表示しない列
+    REPORT_HIDDEN_COLUMNS = ['法人名', '院所名', 'ＹＪコード', '照合方法', '照合スコア']
+
+    # 不良在庫CSVの読み込みエンジン（'c' または 'pyarrow'）
+    CSV_ENGINE = 'c'
+
+    # パイプライン内の列の型。文字列はpyarrowがあればArrow形式で保持し、欠損は空文字列とする。
+    # 在庫量（整数）と使用期限（日時）はExcelへの出力まで型を保持する。
+    TEXT_DTYPE = 'string[pyarrow]' if importlib.util.find_spec('pyarrow') is not None else 'string'
+    TEXT_COLUMNS = ['薬品名', 'ロット番号', '厚労省CD', '品名・規格', '新薬品ｺｰﾄﾞ', 'ＹＪコード']
+    CATEGORY_COLUMNS = ['法人名', '院所名', '単位', '照合方法']
+    DATE_COLUMNS = ['使用期限']
+
+    # 差分処理のスナップショット形式（結果の列や型を変えた場合に加算）
+    SNAPSHOT_VERSION = 2
+
+    # pandas の read_csv が既定で欠損とみなす値（pyarrowエンジンでも同じ扱いにする）
+    CSV_NA_VALUES = [
+        '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+        '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+    ]
+
+    _BOMS = [
+        (codecs.BOM_UTF8, 'utf-8-sig'),
+        (codecs.BOM_UTF16_LE, 'utf-16'),
+        (codecs.BOM_UTF16_BE, 'utf-16'),
+    ]
+
+    @staticmethod
+    def detect_encoding(file_bytes, file_type=None):
+        """先頭 CHARDET_SAMPLE_SIZE バイトのみからエンコーディングを判定する
+
+        file_bytes にはファイル全体または先頭部分を渡す。
+        """
+        # 1. ファイル種別で固定されている場合はそれを使用
+        if file_type in FileProcessor.PINNED_ENCODINGS:
+            return FileProcessor.PINNED_ENCODINGS[file_type]
+
+        sample = bytes(file_bytes[:FileProcessor.CHARDET_SAMPLE_SIZE])
+
+        # 2. BOMの確認
+        for bom, encoding in FileProcessor._BOMS:
+            if sample.startswith(bom):
+                return encoding
+
+        # 3. 厳密なデコードを試行（UTF-8 → CP932）
+        # 先頭部分の末尾で途切れたマルチバイト文字は失敗とみなさない
+        for encoding in ['utf-8', 'cp932']:
+            try:
+                codecs.getincrementaldecoder(encoding)(errors='strict').decode(sample, final=False)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+
+        # 4. 先頭部分のみchardetで推定
+        result = chardet.detect(sample)
+        return result['encoding'] or 'cp932'
+
     @staticmethod
-    def detect_encoding(file_bytes):
-        result = chardet.detect(file_bytes)
-        return result['encoding']
+    def _as_text(series):
+        return series.astype(FileProcessor.TEXT_DTYPE).fillna('')
+
+    @staticmethod
+    def _as_category(series):
+        # 欠損は空文字列とし、カテゴリは文字列順に並べる（並べ替えの結果を文字列の場合と揃える）
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            return FileProcessor._as_text(series).astype('category')
+        if series.isna().any():
+            if '' not in series.cat.categories:
+                series = series.cat.add_categories('')
+            series = series.fillna('')
+        categories = series.cat.categories
+        if not categories.is_monotonic_increasing:
+            series = series.cat.reorder_categories(categories.sort_values())
+        return series
+
+    @staticmethod
+    def _apply_schema(df):
+        """列名に応じて文字列・カテゴリの型に揃える（その他の列はそのまま）"""
+        for col in df.columns:
+            if col in FileProcessor.CATEGORY_COLUMNS:
+                df[col] = FileProcessor._as_category(df[col])
+            elif col in FileProcessor.TEXT_COLUMNS:
+                df[col] = FileProcessor._as_text(df[col])
+        return df
 
     @staticmethod
     def read_excel(file):
@@ -19,225 +143,756 @@ class FileProcessor:
             raise Exception(f"Excelファイルの読み込みエラー: {str(e)}")
 
     @staticmethod
-    def read_csv(file, file_type='default'):
+    def read_purchase_history(file, snapshot_dir=None):
+        """OMEC他院所XLSXから process_data で使用する列のみを読み込む
+
+        snapshot_dir を指定（または環境変数 PURCHASE_SNAPSHOT_DIR を設定）すると、
+        ファイルのハッシュをキーにParquetスナップショットを保存し、
+        次回以降はXLSXの解析を省略する。
+        """
         try:
             file_bytes = file.getvalue()
-            encoding = FileProcessor.detect_encoding(file_bytes)
-            
+            with stage('read', file_type='purchase_history') as record:
+                df = FileProcessor._load_purchase_history(file_bytes, snapshot_dir, record)
+                record['rows_out'] = len(df)
+            return df
+        except Exception as e:
+            raise Exception(f"Excelファイルの読み込みエラー: {str(e)}")
+
+    @staticmethod
+    def _load_purchase_history(file_bytes, snapshot_dir, record):
+        snapshot_dir = snapshot_dir or os.environ.get('PURCHASE_SNAPSHOT_DIR')
+        can_snapshot = snapshot_dir and importlib.util.find_spec('pyarrow') is not None
+
+        snapshot_path = None
+        if can_snapshot:
+            digest = hashlib.sha256(file_bytes).hexdigest()
+            # 購入日の列を含めた形式（purchase_v2）のスナップショットのみ使用する
+            snapshot_path = os.path.join(snapshot_dir, f"purchase_v2_{digest}.parquet")
+            if os.path.exists(snapshot_path):
+                record['source'] = 'snapshot'
+                return FileProcessor._apply_schema(pd.read_parquet(snapshot_path))
+
+        columns = FileProcessor.PURCHASE_COLUMNS
+        optional_columns = [FileProcessor.PURCHASE_DATE_COLUMN]
+        if importlib.util.find_spec('python_calamine') is not None:
+            df = pd.read_excel(
+                io.BytesIO(file_bytes),
+                engine='calamine',
+                usecols=lambda col: col in columns or col in optional_columns
+            )
+            missing = [col for col in columns if col not in df.columns]
+            if missing:
+                raise ValueError(f"必要な列がありません: {', '.join(missing)}")
+            df = df.map(FileProcessor._cell_to_str)
+        else:
+            df = FileProcessor._stream_xlsx_columns(file_bytes, columns, optional_columns)
+        columns = columns + [col for col in optional_columns if col in df.columns]
+        df = FileProcessor._apply_schema(df[columns].copy())
+
+        if snapshot_path:
+            os.makedirs(snapshot_dir, exist_ok=True)
+            write_atomic(snapshot_path, lambda tmp_path: df.to_parquet(tmp_path, index=False))
+
+        return df
+
+    @staticmethod
+    def _cell_to_str(value):
+        if value is None or (isinstance(value, float) and pd.isna(value)):
+            return None
+        # 数値で保存されたコードの「.0」を除去
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+
+    @staticmethod
+    def _stream_xlsx_columns(file_bytes, columns, optional_columns=()):
+        # 読み取り専用モードで行を順に読み、必要な列（と、あれば optional_columns）のみ保持する
+        workbook = load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = next(rows, None) or ()
+            header = [str(h) if h is not None else '' for h in header]
+            missing = [col for col in columns if col not in header]
+            if missing:
+                raise ValueError(f"必要な列がありません: {', '.join(missing)}")
+            columns = list(columns) + [col for col in optional_columns if col in header]
+            indices = [header.index(col) for col in columns]
+
+            data = {col: [] for col in columns}
+            for row in rows:
+                values = [row[i] if i < len(row) else None for i in indices]
+                if all(v is None for v in values):
+                    continue
+                for col, value in zip(columns, values):
+                    data[col].append(FileProcessor._cell_to_str(value))
+        finally:
+            workbook.close()
+
+        return pd.DataFrame(data, columns=columns)
+
+    @staticmethod
+    def read_csv(file, file_type='default', encoding=None):
+        try:
+            file_bytes = file.getvalue()
+            if encoding is None:
+                with stage('encoding_detection', file_type=file_type) as record:
+                    encoding = FileProcessor.detect_encoding(file_bytes, file_type)
+                    record['encoding'] = encoding
+
             if file_type == 'inventory':
-                # 不良在庫データの場合、最初の7行をスキップ
-                df = pd.read_csv(io.BytesIO(file_bytes), encoding=encoding, skiprows=7)
-                
-                # デバッグ用：元のデータ行数を記録
-                print(f"読み込み直後の行数: {len(df)}")
-                
-                # 薬品名が空白の行を削除（より厳密なチェック）
-                # NaN, None, 空文字、空白文字をすべて除外
-                df['薬品名'] = df['薬品名'].astype(str).apply(lambda x: x.strip())
-                df = df[df['薬品名'].apply(lambda x: x not in ['', 'nan', 'None'])]
-                
-                # デバッグ用：薬品名フィルタリング後の行数を記録
-                print(f"薬品名フィルタリング後の行数: {len(df)}")
-                
-                # 在庫量を数値に変換し、0以下の行を削除
-                df['在庫量'] = pd.to_numeric(df['在庫量'], errors='coerce')
-                df = df[df['在庫量'] > 0]
-                
-                # デバッグ用：在庫量フィルタリング後の行数を記録
-                print(f"在庫量フィルタリング後の行数: {len(df)}")
-                
-                # 在庫量を整数に変換
-                df['在庫量'] = df['在庫量'].astype(int)
+                df, report = FileProcessor.read_inventory_csv(file_bytes, encoding)
+                df.attrs['row_counts'] = report
             else:
-                df = pd.read_csv(io.BytesIO(file_bytes), encoding=encoding)
-            
+                with stage('read', file_type=file_type) as record:
+                    df = pd.read_csv(io.BytesIO(file_bytes), encoding=encoding)
+                    record['rows_out'] = len(df)
+
             return df
         except Exception as e:
             raise Exception(f"CSVファイルの読み込みエラー: {str(e)}")
 
     @staticmethod
-    def process_data(purchase_history_df, inventory_df, yj_code_df):
-        try:
-            print("データ処理開始")
-            print(f"入力データの行数: 購入履歴={len(purchase_history_df)}, 在庫={len(inventory_df)}, YJコード={len(yj_code_df)}")
+    def _inventory_csv_options(encoding, engine):
+        if engine == 'pyarrow' and importlib.util.find_spec('pyarrow') is None:
+            engine = 'c'
+        # 不良在庫データの場合、最初の7行をスキップ
+        # 後続処理で使う列のみを文字列として読み込み、型推論を省く
+        return {
+            'encoding': encoding,
+            'skiprows': 7,
+            'usecols': FileProcessor.INVENTORY_COLUMNS,
+            'dtype': {col: FileProcessor.TEXT_DTYPE for col in FileProcessor.INVENTORY_COLUMNS},
+            'engine': engine,
+        }
+
+    @staticmethod
+    def _filter_inventory_rows(df, report):
+        # 薬品名が空白の行を削除
+        # NaN, None, 空文字、空白文字をすべて除外
+        names = df['薬品名'].str.strip()
+        df['薬品名'] = names
+        df = df[names.notna() & ~names.isin(['', 'nan', 'None'])]
+        report['drug_name_filter'] = report.get('drug_name_filter', 0) + len(df)
+
+        # 在庫量を数値に変換し、0以下の行を削除
+        quantity = pd.to_numeric(df['在庫量'], errors='coerce')
+        df = df[quantity > 0].copy()
+        df['在庫量'] = quantity[quantity > 0].astype(int)
+        report['quantity_filter'] = report.get('quantity_filter', 0) + len(df)
+
+        return df
+
+    @staticmethod
+    def read_inventory_csv(file_bytes, encoding, engine=None):
+        """不良在庫CSVを必要な列だけ読み込み、各段階の行数レポートと共に返す"""
+        options = FileProcessor._inventory_csv_options(encoding, engine or FileProcessor.CSV_ENGINE)
+        with stage('read', file_type='inventory', engine=options['engine']) as record:
+            if options['engine'] == 'pyarrow':
+                df = FileProcessor._read_inventory_pyarrow(file_bytes, encoding)
+            else:
+                df = pd.read_csv(io.BytesIO(file_bytes), **options)[FileProcessor.INVENTORY_COLUMNS]
+            record['rows_out'] = len(df)
+
+        report = {'read': len(df)}
+        with stage('filter', rows_in=len(df), file_type='inventory') as record:
+            df = FileProcessor._filter_inventory_rows(df, report)
+            record['rows_out'] = len(df)
+        return df, report
+
+    @staticmethod
+    def _read_inventory_pyarrow(file_bytes, encoding):
+        # pandas の pyarrow エンジンは skiprows をヘッダーの後の行として扱うため、
+        # pyarrow.csv を直接使って前置きの7行を飛ばす
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+
+        table = pa_csv.read_csv(
+            io.BytesIO(file_bytes),
+            read_options=pa_csv.ReadOptions(skip_rows=7, encoding=encoding),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=FileProcessor.INVENTORY_COLUMNS,
+                column_types={col: pa.string() for col in FileProcessor.INVENTORY_COLUMNS},
+                null_values=FileProcessor.CSV_NA_VALUES,
+                strings_can_be_null=True,
+            ),
+        )
+        return table.to_pandas(types_mapper={pa.string(): pd.StringDtype('pyarrow')}.get)
+
+    @staticmethod
+    def iter_inventory_csv(source, encoding, chunksize, report=None):
+        """不良在庫CSVを chunksize 行ずつ読み込み、フィルタ済みのチャンクを返す
+
+        source にはファイルの内容（bytes）またはバイナリのファイルオブジェクトを渡す。
+        ファイルオブジェクトはチャンクごとに読み進め、全体をメモリに読み込まない。
+        """
+        report = report if report is not None else {}
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        # pyarrowエンジンはチャンク読み込みに対応しないためCエンジンを使用
+        options = FileProcessor._inventory_csv_options(encoding, 'c')
+        with pd.read_csv(source, chunksize=chunksize, **options) as reader:
+            for chunk in reader:
+                chunk = chunk[FileProcessor.INVENTORY_COLUMNS]
+                report['read'] = report.get('read', 0) + len(chunk)
+                yield FileProcessor._filter_inventory_rows(chunk, report)
 
-            # データの前処理と検証
+    @staticmethod
+    def _build_yj_mapping(yj_code_df):
+        # 在庫金額CSVから薬品名とＹＪコードのマッピングを作成
+        with stage('yj_mapping_build', rows_in=len(yj_code_df)) as record:
+            columns = yj_code_df[['薬品名', 'ＹＪコード', '単位']].fillna('').astype(str)
+            yj_mapping = dict(zip(columns['薬品名'], zip(columns['ＹＪコード'], columns['単位'])))
+            record['rows_out'] = len(yj_mapping)
+        return yj_mapping
+
+    @staticmethod
+    def build_drug_matcher(yj_mapping):
+        """薬品名 → (ＹＪコード, 単位) の対応から照合用の索引を作成する"""
+        with stage('drug_matcher_build', rows_in=len(yj_mapping)) as record:
+            matcher = DrugNameMatcher(yj_mapping)
+            record['rows_out'] = len(matcher)
+        return matcher
+
+    @staticmethod
+    def _resolve_yj_mapping(yj_code_df, yj_mapping):
+        # 作成済みの照合エンジンはそのまま使い、対応表の場合は索引を作成する
+        if isinstance(yj_mapping, DrugNameMatcher):
+            return yj_mapping
+        if yj_mapping is None:
+            if yj_code_df is None:
+                raise ValueError("在庫金額データまたは薬品マスタが必要です")
+            yj_mapping = FileProcessor._build_yj_mapping(yj_code_df)
+        return FileProcessor.build_drug_matcher(yj_mapping)
+
+    @staticmethod
+    def build_purchase_index(purchase_history_df, rank_by='frequency'):
+        """厚労省CDから購入実績のある院所への重複なしの索引を作成する
+
+        (厚労省CD, 法人名, 院所名, 品名・規格, 新薬品ｺｰﾄﾞ) ごとに1行とし、
+        購入回数・最終購入日（購入日の列がある場合）・最終出現位置を持つ。
+        各厚労省CD内は rank_by（'frequency' または 'recency'）の順に並べる。
+        購入の新しさは購入日で判定し、購入日の列がない場合（または同じ日の場合）は
+        ファイル内で後の行ほど新しいとみなす。
+        """
+        if rank_by not in FileProcessor.PURCHASE_RANKINGS:
+            raise ValueError(f"不明な並び順です: {rank_by}")
+
+        with stage('purchase_index', rows_in=len(purchase_history_df), rank_by=rank_by) as record:
+            # 紐付けに使用する列のみを型を揃えて使用（入力は変更しない）
+            purchase_df = FileProcessor._apply_schema(purchase_history_df[FileProcessor.PURCHASE_COLUMNS].copy())
+            date_column = FileProcessor.PURCHASE_DATE_COLUMN
+            if date_column in purchase_history_df.columns:
+                purchase_df['_date'] = pd.to_datetime(purchase_history_df[date_column], errors='coerce')
+            else:
+                purchase_df['_date'] = pd.NaT
+            record['has_purchase_date'] = date_column in purchase_history_df.columns
+            # 厚労省CDのない行は紐付けできないため除外
+            purchase_df = purchase_df[purchase_df['厚労省CD'].str.strip() != '']
+
+            index_df = (
+                purchase_df.assign(_position=np.arange(len(purchase_df)))
+                .groupby(FileProcessor.PURCHASE_COLUMNS, sort=False, observed=True)
+                .agg(
+                    購入回数=('_position', 'size'),
+                    最終購入日=('_date', 'max'),
+                    最終出現位置=('_position', 'max')
+                )
+                .reset_index()
+            )
+            rank_columns = FileProcessor.PURCHASE_RANKINGS[rank_by]
+            index_df = index_df.sort_values(
+                ['厚労省CD'] + rank_columns,
+                ascending=[True] + [False] * len(rank_columns),
+                kind='stable'
+            ).reset_index(drop=True)
+            record['rows_out'] = len(index_df)
+        return index_df
+
+    @staticmethod
+    def _resolve_purchase_matches(purchase_history_df, purchase_index, top_n):
+        if purchase_index is None:
+            purchase_index = FileProcessor.build_purchase_index(purchase_history_df)
+        # 薬品ごとに上位 top_n 件の院所に絞り込む
+        if top_n is not None:
+            purchase_index = purchase_index.groupby('厚労省CD', sort=False).head(top_n)
+        return purchase_index[FileProcessor.PURCHASE_COLUMNS]
+
+    @staticmethod
+    def _match_inventory(inventory_df, yj_mapping, purchase_matches, keep_columns=()):
+        # データの前処理と検証
+        with stage('filter', rows_in=len(inventory_df)) as record:
             # 空の薬品名を持つ行を削除
-            inventory_df = inventory_df[inventory_df['薬品名'].notna() & (inventory_df['薬品名'].str.strip() != '')]
-            print(f"薬品名フィルタリング後の在庫データ行数: {len(inventory_df)}")
+            inventory_df = inventory_df[inventory_df['薬品名'].notna() & (inventory_df['薬品名'].str.strip() != '')].copy()
+            record['drug_name_rows'] = len(inventory_df)
 
             # 在庫量のバリデーション
             inventory_df['在庫量'] = pd.to_numeric(inventory_df['在庫量'], errors='coerce')
             inventory_df = inventory_df[inventory_df['在庫量'] > 0]
-            print(f"在庫量バリデーション後の行数: {len(inventory_df)}")
+            record['quantity_rows'] = len(inventory_df)
 
             # 使用期限のフォーマットチェックと変換
             inventory_df['使用期限'] = pd.to_datetime(inventory_df['使用期限'], errors='coerce')
             inventory_df = inventory_df[inventory_df['使用期限'].notna()]
-            print(f"使用期限バリデーション後の行数: {len(inventory_df)}")
-
-            # 数値データを文字列に変換し、NaN値を処理
-            for df in [inventory_df, purchase_history_df, yj_code_df]:
-                for col in df.columns:
-                    df[col] = df[col].fillna('').astype(str)
+            record['rows_out'] = len(inventory_df)
 
-            # 在庫金額CSVから薬品名とＹＪコードのマッピングを作成
-            yj_mapping = dict(zip(yj_code_df['薬品名'], zip(yj_code_df['ＹＪコード'], yj_code_df['単位'])))
-            print(f"YJコードマッピング数: {len(yj_mapping)}")
-
-            # 不良在庫データに対してＹＪコードと単位を設定
-            inventory_df['ＹＪコード'] = inventory_df['薬品名'].map(lambda x: yj_mapping.get(x.strip(), (None, None))[0])
-            inventory_df['単位'] = inventory_df['薬品名'].map(lambda x: yj_mapping.get(x.strip(), (None, None))[1])
+            # 在庫量は整数、使用期限は日時のまま保持し、文字列の列のみ型を揃える
+            inventory_df['在庫量'] = inventory_df['在庫量'].astype('int64')
+            inventory_df = FileProcessor._apply_schema(inventory_df)
 
+        # 不良在庫データに対してＹＪコードと単位を設定（照合方法とスコアも記録）
+        with stage('yj_mapping', rows_in=len(inventory_df)) as record:
+            matched = FileProcessor._apply_schema(yj_mapping.match(inventory_df['薬品名']))
+            for col in matched.columns:
+                inventory_df[col] = matched[col]
             # マッピング結果の確認
-            mapped_count = inventory_df['ＹＪコード'].notna().sum()
-            print(f"YJコードマッピング成功数: {mapped_count}/{len(inventory_df)}")
+            record['rows_out'] = int((inventory_df['ＹＪコード'] != '').sum())
+            record['methods'] = {
+                method: int(count) for method, count in inventory_df['照合方法'].value_counts().items()
+            }
 
-            # ＹＪコードと厚労省CDで紐付け
+        # ＹＪコードと厚労省CDで紐付け（索引は重複なしのため行数が膨らまない）
+        with stage('merge', rows_in=len(inventory_df)) as record:
             merged_df = pd.merge(
                 inventory_df,
-                purchase_history_df[['厚労省CD', '法人名', '院所名', '品名・規格', '新薬品ｺｰﾄﾞ']],
+                purchase_matches,
                 left_on='ＹＪコード',
                 right_on='厚労省CD',
                 how='left'
             )
-            print(f"マージ後のデータ行数: {len(merged_df)}")
-
-            # 院所名別にデータを整理
-            result_df = merged_df[[
-                '品名・規格',
-                '在庫量',
-                '単位',
-                '新薬品ｺｰﾄﾞ',
-                '使用期限',
-                'ロット番号',
-                '法人名',
-                '院所名'
-            ]].copy()
-
-            # 空の値を空文字列に変換
-            result_df = result_df.fillna('')
-
-            # データの検証
-            # 必須項目のチェック
-            required_columns = ['品名・規格', '在庫量', '使用期限']
-            for col in required_columns:
-                missing = result_df[result_df[col] == ''].shape[0]
-                print(f"{col}の欠損数: {missing}")
+            record['rows_out'] = len(merged_df)
+
+        # 院所名別にデータを整理
+        result_df = merged_df[FileProcessor.RESULT_COLUMNS + list(keep_columns)].copy()
+
+        # 紐付けのない行の欠損を空文字列に変換
+        return FileProcessor._apply_schema(result_df)
+
+    @staticmethod
+    def process_data(purchase_history_df, inventory_df, yj_code_df=None, yj_mapping=None,
+                     purchase_index=None, top_n=None):
+        """在庫データにＹＪコードを付与し、購入履歴のある院所と紐付ける
+
+        ＹＪコードの対応は在庫金額CSV（yj_code_df）から作成するか、
+        薬品マスタから取得済みの yj_mapping（薬品名 → (ＹＪコード, 単位)）を渡す。
+        build_drug_matcher で作成済みの照合エンジンを渡すと索引の作成を省略できる。
+        薬品名が完全一致しない場合は正規化・類似度で照合し、各行に照合方法と
+        照合スコアを付与する。購入履歴は build_purchase_index で作成済みの purchase_index を渡すと
+        再集計を省略できる。top_n を指定すると薬品ごとに上位の院所のみに絞る。
+        """
+        try:
+            yj_mapping = FileProcessor._resolve_yj_mapping(yj_code_df, yj_mapping)
+            purchase_matches = FileProcessor._resolve_purchase_matches(
+                purchase_history_df, purchase_index, top_n
+            )
+            result_df = FileProcessor._match_inventory(inventory_df, yj_mapping, purchase_matches)
 
             # 院所名でソート
-            result_df = result_df.sort_values(['法人名', '院所名'])
-            print(f"最終データ行数: {len(result_df)}")
+            with stage('sort', rows_in=len(result_df)) as record:
+                # 必須項目の欠損数を記録
+                record['missing'] = {
+                    '品名・規格': int((result_df['品名・規格'] == '').sum()),
+                    '在庫量': int(result_df['在庫量'].isna().sum()),
+                    '使用期限': int(result_df['使用期限'].isna().sum()),
+                }
+                result_df = result_df.sort_values(['法人名', '院所名'])
+                record['rows_out'] = len(result_df)
 
             return result_df
 
         except Exception as e:
-            print(f"データ処理中にエラーが発生: {str(e)}")
+            log_error(f"データ処理中にエラーが発生: {str(e)}")
             raise Exception(f"データ処理エラー: {str(e)}")
 
     @staticmethod
-    def generate_excel(df):
-        excel_buffer = io.BytesIO()
-        
-        # シート名として無効な文字を置換する関数
-        def clean_sheet_name(name):
-            if not isinstance(name, str) or not name.strip():
-                return 'Unknown'
-            # 特殊文字を置換
-            invalid_chars = ['/', '\\', '?', '*', ':', '[', ']']
-            cleaned_name = ''.join('_' if c in invalid_chars else c for c in name)
-            # 最大31文字に制限（Excelの制限）
-            return cleaned_name[:31].strip()
-
-        # ExcelWriterを使用して、院所名ごとにシートを作成
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-            # 院所名ごとにシートを作成（空の値を除外）
-            for name in df['院所名'].unique():
-                if pd.notna(name) and str(name).strip():  # 空の値をスキップ
-                    sheet_name = clean_sheet_name(str(name))
-                    # 該当する院所のデータを抽出
-                    sheet_df = df[df['院所名'] == name].copy()
-                    if not sheet_df.empty:
-                        # 法人名と院所名を取得（ヘッダー用）
-                        houjin_name = sheet_df['法人名'].iloc[0]
-                        insho_name = sheet_df['院所名'].iloc[0]
-                        
-                        # 表示用のカラムから法人名と院所名を除外
-                        display_df = sheet_df.drop(['法人名', '院所名'], axis=1)
-                        
-                        # 「引取り可能数」列を追加
-                        display_df.insert(display_df.columns.get_loc('ロット番号') + 1, '引取り可能数', '')
-                        
-                        # ヘッダー情報を作成
-                        header_data = [
-                            ['不良在庫引き取り依頼'],
-                            [''],
-                            ['{} {} 御中'.format(str(houjin_name).strip(), str(insho_name).strip())],
-                            [''],
-                            ['下記の不良在庫につきまして、引き取りのご検討を賜れますと幸いです。どうぞよろしくお願いいたします。'],
-                            ['']
-                        ]
-                        
-                        # ヘッダー情報をDataFrameに変換
-                        header_df = pd.DataFrame(header_data)
-                        
-                        # ヘッダーとデータを書き込み
-                        header_df.to_excel(writer, sheet_name=sheet_name, index=False, header=False)
-                        display_df.to_excel(writer, sheet_name=sheet_name, startrow=6, index=False)
-                        
-                        # シートを取得してフォーマットを設定
-                        worksheet = writer.sheets[sheet_name]
-                        
-                        from openpyxl.styles import Border, Side
-                        # 列幅の設定
-                        worksheet.column_dimensions['A'].width = 35  # 255ピクセルは約35文字幅
-                        
-                        # データの開始行（ヘッダーの後）
-                        data_start_row = 7
-                        
-                        # B～G列の幅を125ピクセル（約17文字幅）に設定
-                        for col in ['B', 'C', 'D', 'E', 'F', 'G']:
-                            worksheet.column_dimensions[col].width = 17
-                        
-                        # 罫線スタイルの定義
-                        thin_border = Border(
-                            left=Side(style='thin'),
-                            right=Side(style='thin'),
-                            top=Side(style='thin'),
-                            bottom=Side(style='thin')
+    def process_data_chunked(purchase_history_df, inventory_file, yj_code_df, output,
+                             chunksize=50000, encoding=None, yj_mapping=None,
+                             purchase_index=None, top_n=None):
+        """不良在庫CSVをチャンク単位で処理し、結果を output に逐次書き出す
+
+        YJコードのマッピングと購入履歴は一度だけ準備し、在庫データは
+        chunksize 行ずつ読み込んで紐付けるため、メモリ使用量は在庫データの
+        サイズに依存しない。inventory_file にはパスまたはシーク可能なバイナリの
+        ファイルオブジェクトを指定し、エンコーディングは先頭部分のみから判定する。
+        出力は入力順（法人名・院所名でのソートなし）のCSVで、output には
+        パスまたは書き込み可能なファイルオブジェクトを指定する。
+        書き出した行数を返す。
+        """
+        try:
+            yj_mapping = FileProcessor._resolve_yj_mapping(yj_code_df, yj_mapping)
+            purchase_matches = FileProcessor._resolve_purchase_matches(
+                purchase_history_df, purchase_index, top_n
+            )
+
+            owns_input = isinstance(inventory_file, (str, os.PathLike))
+            source = open(inventory_file, 'rb') if owns_input else inventory_file
+            owns_output = isinstance(output, (str, os.PathLike))
+            out = None
+            try:
+                if encoding is None:
+                    with stage('encoding_detection', file_type='inventory') as record:
+                        start = source.tell()
+                        encoding = FileProcessor.detect_encoding(
+                            source.read(FileProcessor.CHARDET_SAMPLE_SIZE), 'inventory'
                         )
-                        
-                        # データ部分に罫線を追加
-                        for row in worksheet.iter_rows(min_row=data_start_row):
-                            for cell in row:
-                                cell.border = thin_border
-                        
-                        # 行の高さを設定（30ピクセル）
-                        for row in range(1, worksheet.max_row + 1):
-                            worksheet.row_dimensions[row].height = 30
-                        
-                        # すべてのセルのフォントサイズを14に設定
-                        for row in worksheet.iter_rows():
-                            for cell in row:
-                                if cell.font is None:
-                                    cell.font = cell.font.copy()
-                                cell.font = cell.font.copy(size=14)
-                        
-                        # 特定のセルのフォント設定を上書き
-                        cell_a1 = worksheet['A1']
-                        cell_a1.font = cell_a1.font.copy(size=16)
-                        
-                        cell_a3 = worksheet['A3']
-                        cell_a3.font = cell_a3.font.copy(size=14, bold=True)
-
-                        # 印刷設定
-                        worksheet.page_setup.orientation = worksheet.ORIENTATION_LANDSCAPE
-                        worksheet.print_title_rows = '1:7'  # 1-7行目をタイトル行として設定
-                        worksheet.page_setup.fitToPage = True
-                        worksheet.page_setup.fitToHeight = 0  # 高さは自動
-                        worksheet.page_setup.fitToWidth = 1  # 幅は1ページに収める
-        
+                        source.seek(start)
+                        record['encoding'] = encoding
+
+                out = open(output, 'w', encoding='utf-8-sig', newline='') if owns_output else output
+                total_rows = 0
+                write_header = True
+                for chunk in FileProcessor.iter_inventory_csv(source, encoding, chunksize):
+                    result_df = FileProcessor._match_inventory(chunk, yj_mapping, purchase_matches)
+                    result_df.to_csv(out, index=False, header=write_header)
+                    write_header = False
+                    total_rows += len(result_df)
+            finally:
+                if owns_output and out is not None:
+                    out.close()
+                if owns_input:
+                    source.close()
+
+            return total_rows
+
+        except Exception as e:
+            log_error(f"データ処理中にエラーが発生: {str(e)}")
+            raise Exception(f"データ処理エラー: {str(e)}")
+
+    @staticmethod
+    def fingerprint_inventory(inventory_df):
+        """在庫データの各行に識別キーとフィンガープリントを付与する
+
+        識別キーは (薬品名, ロット番号, 同一組内の出現順)、フィンガープリントは
+        (薬品名, ロット番号, 使用期限, 在庫量) のハッシュ値。
+        """
+        keys = FileProcessor._apply_schema(inventory_df[['薬品名', 'ロット番号']].copy())
+        occurrence = keys.groupby(['薬品名', 'ロット番号'], sort=False).cumcount().astype(str)
+        row_key = keys['薬品名'] + '\x1f' + keys['ロット番号'] + '\x1f' + occurrence
+        fingerprint = pd.util.hash_pandas_object(inventory_df[FileProcessor.FINGERPRINT_COLUMNS], index=False)
+        return pd.DataFrame(
+            {'_row_key': row_key.to_numpy(), '_fingerprint': fingerprint.to_numpy()},
+            index=inventory_df.index
+        )
+
+    @staticmethod
+    def process_data_incremental(purchase_history_df, inventory_df, previous_snapshot=None,
+                                 context_key=None, yj_code_df=None, yj_mapping=None,
+                                 purchase_index=None, top_n=None):
+        """前回のスナップショットとの差分のみを再処理する
+
+        追加・変更された行だけをＹＪコード付与と紐付けにかけ、変更のない行は
+        前回の結果を再利用する。context_key（購入履歴・薬品マスタ・条件の識別子）が
+        前回と異なる場合は全件を処理する。
+        (result_df, snapshot, report) を返し、snapshot は次回の previous_snapshot に渡す。
+        """
+        try:
+            yj_mapping = FileProcessor._resolve_yj_mapping(yj_code_df, yj_mapping)
+            purchase_matches = FileProcessor._resolve_purchase_matches(
+                purchase_history_df, purchase_index, top_n
+            )
+
+            with stage('diff', rows_in=len(inventory_df)) as record:
+                current = FileProcessor.fingerprint_inventory(inventory_df)
+                # 結果の列や型が異なる（古い形式の）スナップショットは再利用しない
+                reusable = (
+                    previous_snapshot is not None
+                    and context_key is not None
+                    and previous_snapshot.get('version') == FileProcessor.SNAPSHOT_VERSION
+                    and previous_snapshot['context_key'] == context_key
+                )
+
+                if reusable:
+                    previous_rows = previous_snapshot['rows']
+                    known = current['_row_key'].isin(previous_rows['_row_key'])
+                    unchanged = pd.MultiIndex.from_frame(current).isin(
+                        pd.MultiIndex.from_frame(previous_rows[['_row_key', '_fingerprint']])
+                    )
+                    dirty = ~unchanged
+                    previous_results = previous_snapshot['results']
+                    reused_df = previous_results[
+                        previous_results['_row_key'].isin(current.loc[unchanged, '_row_key'])
+                    ]
+                    report = {
+                        'added': int((~known).sum()),
+                        'changed': int((known & ~unchanged).sum()),
+                        'removed': int((~previous_rows['_row_key'].isin(current['_row_key'])).sum()),
+                        'unchanged': int(unchanged.sum()),
+                        'full_recompute': False,
+                    }
+                else:
+                    dirty = np.ones(len(current), dtype=bool)
+                    reused_df = None
+                    report = {
+                        'added': len(current),
+                        'changed': 0,
+                        'removed': 0,
+                        'unchanged': 0,
+                        'full_recompute': True,
+                    }
+                record.update(report)
+                record['rows_out'] = int(np.count_nonzero(dirty))
+
+            fresh_df = FileProcessor._match_inventory(
+                inventory_df[dirty].assign(_row_key=current.loc[dirty, '_row_key']),
+                yj_mapping,
+                purchase_matches,
+                keep_columns=['_row_key']
+            )
+            if reused_df is not None:
+                # 空のフレームは結合の型の決定に含めない（変更なし・全件変更の場合）
+                frames = [df for df in (reused_df, fresh_df) if len(df)] or [fresh_df]
+                # カテゴリが異なる列は結合で object になるため型を揃え直す
+                results = FileProcessor._apply_schema(pd.concat(frames, ignore_index=True))
+            else:
+                results = fresh_df
+
+            snapshot = {
+                'version': FileProcessor.SNAPSHOT_VERSION,
+                'context_key': context_key,
+                'rows': current.reset_index(drop=True),
+                'results': results.reset_index(drop=True),
+            }
+
+            # 院所名でソート
+            with stage('sort', rows_in=len(results)) as record:
+                result_df = results.drop(columns='_row_key').sort_values(['法人名', '院所名'])
+                record['rows_out'] = len(result_df)
+
+            return result_df, snapshot, report
+
+        except Exception as e:
+            log_error(f"データ処理中にエラーが発生: {str(e)}")
+            raise Exception(f"データ処理エラー: {str(e)}")
+
+    @staticmethod
+    def filter_results(result_df, corporation=None, institution=None, expiry_from=None, expiry_to=None):
+        """処理結果を法人名・院所名・使用期限の範囲で絞り込む"""
+        mask = np.ones(len(result_df), dtype=bool)
+        if corporation:
+            mask &= (result_df['法人名'] == corporation).to_numpy()
+        if institution:
+            mask &= (result_df['院所名'] == institution).to_numpy()
+        if expiry_from or expiry_to:
+            expiry = pd.to_datetime(result_df['使用期限'], errors='coerce')
+            if expiry_from:
+                mask &= (expiry >= pd.Timestamp(expiry_from)).to_numpy()
+            if expiry_to:
+                mask &= (expiry <= pd.Timestamp(expiry_to)).to_numpy()
+        return result_df[mask]
+
+    @staticmethod
+    def _clean_sheet_name(name):
+        # シート名として無効な文字を置換する
+        if not isinstance(name, str) or not name.strip():
+            return 'Unknown'
+        # 特殊文字を置換
+        invalid_chars = ['/', '\\', '?', '*', ':', '[', ']']
+        cleaned_name = ''.join('_' if c in invalid_chars else c for c in name)
+        # 最大31文字に制限（Excelの制限）
+        return cleaned_name[:31].strip()
+
+    @staticmethod
+    def _unique_sheet_name(name, used_names):
+        # 整形後に同名になった院所のシートが上書きされないよう連番を付与
+        candidate = name
+        suffix = 2
+        while candidate.lower() in used_names:
+            tail = f"_{suffix}"
+            candidate = name[:31 - len(tail)] + tail
+            suffix += 1
+        used_names.add(candidate.lower())
+        return candidate
+
+    @staticmethod
+    def _register_report_styles(workbook):
+        # セルごとにフォントや罫線をコピーせず、共有の名前付きスタイルを割り当てる
+        thin = Side(style='thin')
+        thin_border = Border(left=thin, right=thin, top=thin, bottom=thin)
+
+        def font(**kwargs):
+            f = copy(DEFAULT_FONT)
+            for key, value in kwargs.items():
+                setattr(f, key, value)
+            return f
+
+        styles = [
+            NamedStyle(name='report_title', font=font(size=16)),
+            NamedStyle(name='report_addressee', font=font(size=14, bold=True)),
+            NamedStyle(name='report_text', font=font(size=14)),
+            NamedStyle(
+                name='report_table_header',
+                font=font(size=14, bold=True),
+                border=thin_border,
+                alignment=Alignment(horizontal='center', vertical='top')
+            ),
+            NamedStyle(name='report_table_cell', font=font(size=14), border=thin_border),
+            NamedStyle(
+                name='report_table_date',
+                font=font(size=14),
+                border=thin_border,
+                number_format='yyyy-mm-dd'
+            ),
+        ]
+        for style in styles:
+            workbook.add_named_style(style)
+
+    @staticmethod
+    def _write_report_sheet(worksheet, houjin_name, insho_name, columns, rows):
+        def cell(value, style):
+            c = WriteOnlyCell(worksheet, value)
+            c.style = style
+            return c
+
+        # 列幅の設定
+        worksheet.column_dimensions['A'].width = 35  # 255ピクセルは約35文字幅
+        # B～G列の幅を125ピクセル（約17文字幅）に設定
+        for col in ['B', 'C', 'D', 'E', 'F', 'G']:
+            worksheet.column_dimensions[col].width = 17
+
+        # 行の高さを設定（30ピクセル）
+        header_rows = 6
+        for row in range(1, header_rows + len(rows) + 2):
+            worksheet.row_dimensions[row].height = 30
+
+        # 印刷設定
+        worksheet.page_setup.orientation = 'landscape'
+        worksheet.print_title_rows = '1:7'  # 1-7行目をタイトル行として設定
+        worksheet.sheet_properties.pageSetUpPr.fitToPage = True
+        worksheet.page_setup.fitToHeight = 0  # 高さは自動
+        worksheet.page_setup.fitToWidth = 1  # 幅は1ページに収める
+
+        # ヘッダー情報
+        worksheet.append([cell('不良在庫引き取り依頼', 'report_title')])
+        worksheet.append([])
+        worksheet.append([cell('{} {} 御中'.format(str(houjin_name).strip(), str(insho_name).strip()), 'report_addressee')])
+        worksheet.append([])
+        worksheet.append([cell('下記の不良在庫につきまして、引き取りのご検討を賜れますと幸いです。どうぞよろしくお願いいたします。', 'report_text')])
+        worksheet.append([])
+
+        # 罫線付きの表（使用期限などの日時は日付の書式で出力）
+        worksheet.append([cell(name, 'report_table_header') for name in columns])
+        cell_styles = [
+            'report_table_date' if name in FileProcessor.DATE_COLUMNS else 'report_table_cell'
+            for name in columns
+        ]
+        for row in rows:
+            worksheet.append([cell(value, style) for value, style in zip(row, cell_styles)])
+
+    @staticmethod
+    def generate_excel(df, write_only=True):
+        """院所名ごとのシートを持つ引き取り依頼Excelを生成する
+
+        データは一度のgroupbyで院所ごとに分割し、書式は名前付きスタイルで
+        共有する。write_only=True の場合は openpyxl の書き込み専用モードで
+        行を逐次書き出すため、メモリ使用量が抑えられる。使用期限などの日時は
+        日付の書式を付けたセルとして出力する。
+        """
+        with stage('excel_generation', rows_in=len(df), mode='workbook') as record:
+            workbook = Workbook(write_only=write_only)
+            if not write_only:
+                workbook.remove(workbook.active)
+            FileProcessor._register_report_styles(workbook)
+
+            # 表示用のカラムから法人名・院所名などを除外し、「引取り可能数」列を追加
+            data_columns = [c for c in df.columns if c not in FileProcessor.REPORT_HIDDEN_COLUMNS]
+            columns = list(data_columns)
+            pickup_index = columns.index('ロット番号') + 1 if 'ロット番号' in columns else len(columns)
+            columns.insert(pickup_index, '引取り可能数')
+
+            # 欠損値は空セルとして出力
+            data = df[data_columns]
+            values = data.astype(object).where(data.notna(), None).to_numpy()
+            houjin_names = df['法人名'].to_numpy()
+
+            used_names = set()
+            # 院所名ごとにシートを作成（空の値を除外）
+            for name, positions in df.groupby('院所名', sort=False, observed=True).indices.items():
+                if not str(name).strip():
+                    continue
+                sheet_name = FileProcessor._unique_sheet_name(
+                    FileProcessor._clean_sheet_name(str(name)), used_names
+                )
+                worksheet = workbook.create_sheet(sheet_name)
+                rows = [
+                    list(row[:pickup_index]) + [''] + list(row[pickup_index:])
+                    for row in values[positions]
+                ]
+                FileProcessor._write_report_sheet(
+                    worksheet, houjin_names[positions[0]], name, columns, rows
+                )
+
+            # 院所が1件もない場合も有効なブックとして保存できるようにする
+            if not workbook.worksheets:
+                workbook.create_sheet('Sheet')
+
+            excel_buffer = io.BytesIO()
+            workbook.save(excel_buffer)
+            record['sheets'] = len(workbook.worksheets)
         excel_buffer.seek(0)
         return excel_buffer
 
+    @staticmethod
+    def _clean_file_name(name):
+        # ファイル名として無効な文字を置換する
+        invalid_chars = ['/', '\\', '?', '*', ':', '[', ']', '"', '<', '>', '|']
+        cleaned_name = ''.join('_' if c in invalid_chars else c for c in str(name).strip())
+        return cleaned_name or 'Unknown'
+
+    @staticmethod
+    def _render_institution_workbook(df):
+        # プロセスプール上で実行されるため、Excelのバイト列を返す
+        return FileProcessor.generate_excel(df).getvalue()
+
+    @staticmethod
+    def generate_excel_bundle(df, max_workers=None):
+        """法人名・院所名ごとに個別のExcelを生成し、ZIPにまとめて返す
+
+        各院所のブックはプロセスプールで並列に生成し、完成したものから
+        順にZIPへ書き込む。max_workers=1 の場合は同一プロセスで処理する。
+        """
+        with stage('excel_generation', rows_in=len(df), mode='zip') as record:
+            # 院所ごとにデータを分割（空の院所名は除外）
+            partitions = [
+                (houjin_name, insho_name, part)
+                for (houjin_name, insho_name), part in df.groupby(['法人名', '院所名'], sort=False, observed=True)
+                if str(insho_name).strip()
+            ]
+            # 同名になるファイル名には連番を付ける（完成順によらず院所の順に決める）
+            file_names = []
+            used_names = set()
+            for houjin_name, insho_name, _ in partitions:
+                base_name = FileProcessor._clean_file_name(f"{houjin_name}_{insho_name}")
+                file_name = f"{base_name}.xlsx"
+                suffix = 2
+                while file_name in used_names:
+                    file_name = f"{base_name}_{suffix}.xlsx"
+                    suffix += 1
+                used_names.add(file_name)
+                file_names.append(file_name)
+
+            zip_buffer = io.BytesIO()
+            # xlsxは既に圧縮済みのため無圧縮で格納する
+            with zipfile.ZipFile(zip_buffer, 'w', compression=zipfile.ZIP_STORED) as bundle:
+                if max_workers == 1 or len(partitions) <= 1:
+                    for file_name, (_, _, part) in zip(file_names, partitions):
+                        bundle.writestr(file_name, FileProcessor._render_institution_workbook(part))
+                else:
+                    # Streamlit のサーバーはロックを保持したスレッドを持つため、
+                    # fork ではなく spawn でワーカーを起動する
+                    with ProcessPoolExecutor(
+                        max_workers=max_workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    ) as executor:
+                        futures = {
+                            executor.submit(FileProcessor._render_institution_workbook, part): file_name
+                            for file_name, (_, _, part) in zip(file_names, partitions)
+                        }
+                        # 時間のかかる院所を待たずに、完成したものから書き込む
+                        for future in as_completed(futures):
+                            bundle.writestr(futures[future], future.result())
+
+            record['files'] = len(partitions)
+        zip_buffer.seek(0)
+        return zip_buffer
+
     
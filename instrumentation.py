@@ -0,0 +1,182 @@
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import resource
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# 環境変数
+#   PIPELINE_LOG_FILE    : 構造化ログ（JSON Lines）の出力先。未設定時は標準エラー出力
+#   PIPELINE_PROFILE_DIR : 設定時、処理ごとに cProfile の結果を <run_id>.prof として保存
+#   PIPELINE_TRACEMALLOC : 1 の場合、tracemalloc で段階ごとのピークメモリを計測
+#                          （tracemalloc はプロセス全体で1つのため、ピークは他のスレッドの
+#                            確保も含む。段階ごとの値として使えるのは JOB_WORKERS=1 の場合のみ）
+#   PIPELINE_RECENT_RUNS : 管理画面用に保持する直近の処理件数
+
+logger = logging.getLogger('pipeline')
+
+_current_run = contextvars.ContextVar('pipeline_run', default=None)
+# 実行中の段階の tracemalloc のピーク（入れ子の段階の計測で親のピークを失わないため）
+_current_peak = contextvars.ContextVar('pipeline_stage_peak', default=None)
+_recent_runs = deque(maxlen=int(os.environ.get('PIPELINE_RECENT_RUNS', 50)))
+_recent_lock = threading.Lock()
+
+
+def _configure_logger():
+    if logger.handlers:
+        return
+    log_file = os.environ.get('PIPELINE_LOG_FILE')
+    handler = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+_configure_logger()
+
+# tracemalloc はプロセス全体で有効になるため、起動時に一度だけ開始する
+if os.environ.get('PIPELINE_TRACEMALLOC') == '1' and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+def _log(event, payload):
+    record = {'event': event, 'timestamp': datetime.now().isoformat(timespec='milliseconds')}
+    record.update(payload)
+    logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+_PAGE_SIZE = resource.getpagesize()
+
+
+def _rss_mb():
+    """現在のRSS（MB）を返す。取得できない環境では None"""
+    # ru_maxrss はプロセス起動後の最大値で、長時間動作するサーバーでは
+    # 段階ごとの違いが分からないため、/proc から現在の値を読む
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PipelineRun:
+    """1回分の処理（アップロードの処理など）の段階別計測結果"""
+
+    def __init__(self, name, **fields):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.fields = fields
+        self.started_at = datetime.now()
+        self.seconds = None
+        self.status = 'running'
+        self.stages = []
+        # 実行中の段階名（進捗表示用）
+        self.current_stage = None
+
+    def summary(self):
+        return {
+            'run_id': self.run_id,
+            'name': self.name,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'seconds': self.seconds,
+            'status': self.status,
+            **self.fields,
+        }
+
+
+@contextmanager
+def pipeline_run(name, **fields):
+    """処理全体を1件の計測単位として記録する"""
+    run = PipelineRun(name, **fields)
+    token = _current_run.set(run)
+
+    profile_dir = os.environ.get('PIPELINE_PROFILE_DIR')
+    profiler = cProfile.Profile() if profile_dir else None
+    if profiler:
+        profiler.enable()
+
+    start = time.perf_counter()
+    try:
+        yield run
+        run.status = 'ok'
+    except Exception:
+        run.status = 'error'
+        raise
+    finally:
+        run.seconds = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(profile_dir, f"{run.run_id}.prof"))
+        _current_run.reset(token)
+        # キャッシュから返しただけの実行（段階なし）は一覧に残さない
+        if run.stages:
+            with _recent_lock:
+                _recent_runs.appendleft(run)
+            _log('run', run.summary())
+
+
+@contextmanager
+def stage(name, rows_in=None, **fields):
+    """処理段階の所要時間・入出力行数・メモリを記録する
+
+    メモリは段階の前後の現在のRSS（rss_mb・rss_delta_mb）と、tracemalloc が
+    有効な場合はその段階（入れ子の段階を含む）のピーク（peak_mb）を記録する。
+    yield される辞書に rows_out などを設定すると記録に含まれる。
+    """
+    record = {'stage': name, 'rows_in': rows_in, 'rows_out': None, **fields}
+    rss_before = _rss_mb()
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        # 親の段階のここまでのピークを退避してから計測し直す
+        parent_peak = _current_peak.get()
+        if parent_peak is not None:
+            parent_peak[0] = max(parent_peak[0], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        peak = [0]
+        peak_token = _current_peak.set(peak)
+
+    run = _current_run.get()
+    if run is not None:
+        parent_stage, run.current_stage = run.current_stage, name
+
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        if tracing:
+            peak[0] = max(peak[0], tracemalloc.get_traced_memory()[1])
+            _current_peak.reset(peak_token)
+            record['peak_mb'] = peak[0] / 1024 / 1024
+            # 親の段階には入れ子の段階のピークを引き継ぎ、以降を計測し直す
+            if parent_peak is not None:
+                parent_peak[0] = max(parent_peak[0], peak[0])
+            tracemalloc.reset_peak()
+        rss_after = _rss_mb()
+        if rss_after is not None:
+            record['rss_mb'] = rss_after
+            record['rss_delta_mb'] = rss_after - rss_before
+
+        if run is not None:
+            record['run_id'] = run.run_id
+            run.stages.append(record)
+            run.current_stage = parent_stage
+        _log('stage', record)
+
+
+def log_error(message, **fields):
+    _log('error', {'message': message, **fields})
+
+
+def recent_runs():
+    with _recent_lock:
+        return list(_recent_runs)
@@ -0,0 +1,300 @@
+import io
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from cache import get_shared_cache
+from database import Database
+from file_processor import FileProcessor
+from instrumentation import log_error, pipeline_run
+from snapshot_store import SnapshotStore, write_atomic
+
+# 環境変数
+#   JOB_WORKERS      : 同時に実行する処理の数（全利用者の合計）
+#   JOB_MAX_PER_USER : 利用者ごとに同時に投入できる処理の数（待機中を含む）
+#   JOB_RESULT_DIR   : 処理結果の保存先
+#   JOB_KEEP_PER_USER: 利用者ごとに保持する完了・失敗したジョブの数（処理履歴の表示件数）
+#   JOB_RESULT_TTL_HOURS : 完了・失敗したジョブと結果ファイルを保持する時間
+
+
+def process_upload(username, purchase_bytes, inventory_bytes, yj_code_bytes=None,
+                   top_n=0, incremental=True, db=None):
+    """アップロードされた3ファイルを処理し、(処理結果, 結果キー, 保存行数) を返す
+
+    読み込み・索引・処理結果はファイル内容のハッシュをキーに共有キャッシュへ保持する。
+    処理結果は共有キャッシュの result:{結果キー} に保持される。
+    保存行数は同じ処理結果が保存済みの場合 None。
+    """
+    cache = get_shared_cache()
+    db = db or Database()
+
+    # ファイル内容のハッシュをキーにキャッシュ
+    purchase_key = cache.file_key(purchase_bytes, 'purchase_history')
+    inventory_key = cache.file_key(inventory_bytes, 'inventory')
+
+    # ファイル読み込み
+    purchase_df = cache.get_or_compute(
+        purchase_key,
+        lambda: FileProcessor.read_purchase_history(io.BytesIO(purchase_bytes))
+    )
+    inventory_df = cache.get_or_compute(
+        inventory_key,
+        lambda: FileProcessor.read_csv(io.BytesIO(inventory_bytes), file_type='inventory')
+    )
+
+    # 購入履歴の索引はファイルごとに一度だけ作成
+    purchase_index = cache.get_or_compute(
+        f"purchase_index:{purchase_key}",
+        lambda: FileProcessor.build_purchase_index(purchase_df)
+    )
+
+    # 在庫金額ファイルがアップロードされた場合は薬品マスタを更新
+    # （マスタは他の利用者・プロセスからも更新されるため毎回反映する。
+    #   変更のない行は書き込まれず、バージョンも変わらない）
+    if yj_code_bytes:
+        yj_code_key = cache.file_key(yj_code_bytes, 'yj_code')
+        yj_code_df = cache.get_or_compute(
+            yj_code_key,
+            lambda: FileProcessor.read_csv(io.BytesIO(yj_code_bytes))
+        )
+        db.update_drug_master(yj_code_df)
+    master_version, yj_mapping = db.get_drug_master_matcher()
+    if not yj_mapping:
+        raise Exception("薬品マスタが登録されていません。在庫金額ファイルを選択してください")
+
+    # データ処理
+    # 登録する行の内容は入力ファイル・薬品マスタ・条件で決まり、処理結果には
+    # 差分処理の報告が付くため、処理方法も含めたものを結果キーとする。
+    # 差分処理は利用者ごとのスナップショットを読み書きし、その利用者の差分を
+    # 報告するため、利用者も結果キーに含めて他の利用者と共有しない
+    mode = 'incremental' if incremental else 'full'
+    output_key = cache.combine_keys(
+        purchase_key, inventory_key, f"drug_master:{master_version}", f"top_n:{top_n}"
+    )
+    if incremental:
+        result_key = cache.combine_keys(output_key, f"mode:{mode}", f"user:{username}")
+    else:
+        result_key = cache.combine_keys(output_key, f"mode:{mode}")
+
+    def compute_result():
+        if not incremental:
+            return FileProcessor.process_data(
+                purchase_df,
+                inventory_df,
+                yj_mapping=yj_mapping,
+                purchase_index=purchase_index,
+                top_n=top_n or None
+            )
+        # 利用者ごとの前回スナップショットとの差分のみ処理
+        store = SnapshotStore()
+        df, snapshot, report = FileProcessor.process_data_incremental(
+            purchase_df,
+            inventory_df,
+            previous_snapshot=store.load(username),
+            context_key=cache.combine_keys(
+                purchase_key, f"drug_master:{master_version}", f"top_n:{top_n}"
+            ),
+            yj_mapping=yj_mapping,
+            purchase_index=purchase_index,
+            top_n=top_n or None
+        )
+        store.save(username, snapshot)
+        df.attrs['incremental_report'] = report
+        return df
+
+    result_df = cache.get_or_compute(f"result:{result_key}", compute_result)
+
+    # データベースへの保存（同じ入力ファイルの重複登録は入力のみのハッシュで判定）
+    saved_rows = db.save_inventory(
+        result_df, cache.combine_keys(purchase_key, inventory_key), output_key
+    )
+    return result_df, result_key, saved_rows
+
+
+class JobManager:
+    """アップロードの処理をバックグラウンドのワーカーで実行する
+
+    処理結果とダウンロード用のExcel（またはZIP）はワーカーで作成して保存し、
+    ジョブの状態とファイルの保存先はデータベースに記録する。
+    ブラウザを再読み込みしても完了したジョブの結果を表示できるようにする。
+    実行中の段階（instrumentation の stage）はメモリ上で参照できる。
+    処理履歴に表示されなくなった（利用者ごとの新しい keep_jobs 件に含まれない）
+    ジョブと、result_ttl_hours 時間より前に終了したジョブは結果ファイルごと削除する。
+    """
+
+    def __init__(self, max_workers=2, max_per_user=1, result_dir='.job_results',
+                 keep_jobs=10, result_ttl_hours=168):
+        self.max_workers = max_workers
+        self.max_per_user = max_per_user
+        self.result_dir = result_dir
+        self.keep_jobs = keep_jobs
+        self.result_ttl_hours = result_ttl_hours
+        self.db = Database()
+        # 単一プロセスで動作する前提で、前回の起動時に残ったジョブを整理する
+        self.db.fail_interrupted_jobs()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._active = {}
+        self._runs = {}
+
+    def submit(self, username, purchase_bytes, inventory_bytes, yj_code_bytes=None,
+               top_n=0, incremental=True, bundle=False):
+        """処理をキューに投入してジョブIDを返す
+
+        bundle が True の場合は院所別ファイルのZIP、それ以外は院所別シートの
+        Excelをダウンロード用に作成する。
+        """
+        with self._lock:
+            if self._active.get(username, 0) >= self.max_per_user:
+                raise Exception(
+                    f"同時に実行できる処理は{self.max_per_user}件までです。実行中の処理の完了をお待ちください"
+                )
+            self._active[username] = self._active.get(username, 0) + 1
+
+        job_id = uuid.uuid4().hex
+        try:
+            self.prune_jobs(username)
+            self.db.create_job(job_id, username)
+            self._executor.submit(
+                self._run, job_id, username, purchase_bytes, inventory_bytes,
+                yj_code_bytes, top_n, incremental, bundle
+            )
+        except Exception:
+            self._release(username)
+            raise
+        return job_id
+
+    def _release(self, username):
+        with self._lock:
+            self._active[username] -= 1
+            if not self._active[username]:
+                del self._active[username]
+
+    def _run(self, job_id, username, purchase_bytes, inventory_bytes, yj_code_bytes,
+             top_n, incremental, bundle):
+        try:
+            self.db.start_job(job_id)
+            cache = get_shared_cache()
+            with pipeline_run('upload', user=username, job_id=job_id) as run:
+                with self._lock:
+                    self._runs[job_id] = run
+                result_df, result_key, saved_rows = process_upload(
+                    username, purchase_bytes, inventory_bytes, yj_code_bytes,
+                    top_n=top_n, incremental=incremental, db=self.db
+                )
+
+                # ダウンロード用のファイルも画面のスレッドではなくワーカーで作成する
+                if bundle:
+                    report = cache.get_or_compute(
+                        f"bundle:{result_key}",
+                        lambda: FileProcessor.generate_excel_bundle(result_df).getvalue()
+                    )
+                else:
+                    report = cache.get_or_compute(
+                        f"excel:{result_key}",
+                        lambda: FileProcessor.generate_excel(result_df).getvalue()
+                    )
+
+            os.makedirs(self.result_dir, exist_ok=True)
+            result_path = os.path.join(self.result_dir, f"{job_id}.pkl")
+            report_path = os.path.join(self.result_dir, f"{job_id}.{'zip' if bundle else 'xlsx'}")
+            write_atomic(result_path, result_df.to_pickle)
+
+            def write_report(path):
+                with open(path, 'wb') as f:
+                    f.write(report)
+
+            write_atomic(report_path, write_report)
+            self.db.finish_job(
+                job_id, result_path, report_path, result_key, len(result_df), saved_rows
+            )
+        except Exception as e:
+            log_error(f"ジョブの処理に失敗しました: {str(e)}", job_id=job_id, user=username)
+            try:
+                self.db.fail_job(job_id, str(e))
+            except Exception as db_error:
+                log_error(f"ジョブの状態を更新できませんでした: {str(db_error)}", job_id=job_id)
+        finally:
+            with self._lock:
+                self._runs.pop(job_id, None)
+            self._release(username)
+
+    def prune_jobs(self, username):
+        """保持期間を過ぎたジョブと結果ファイルを削除し、削除したジョブの数を返す"""
+        expired = self.db.delete_expired_jobs(username, self.keep_jobs, self.result_ttl_hours)
+        for paths in expired:
+            for path in paths:
+                if not path:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    log_error(f"結果ファイルを削除できませんでした: {str(e)}", path=path)
+        return len(expired)
+
+    def get(self, job_id, username):
+        return self.db.get_job(job_id, username)
+
+    def list_jobs(self, username):
+        return self.db.list_jobs(username, self.keep_jobs)
+
+    def progress(self, job_id):
+        """実行中のジョブの (実行中の段階名, 完了した段階の記録) を返す"""
+        with self._lock:
+            run = self._runs.get(job_id)
+        if run is None:
+            return None, []
+        return run.current_stage, list(run.stages)
+
+    def load_result(self, job):
+        """完了したジョブの処理結果を読み込む
+
+        process_upload と同じ result:{結果キー} に保持するため、同じ処理結果を
+        キャッシュに重ねて持たない。
+        """
+        if job['status'] != 'done' or not job['result_path']:
+            return None
+        return get_shared_cache().get_or_compute(
+            f"result:{job['result_key']}",
+            lambda: pd.read_pickle(job['result_path'])
+        )
+
+    def load_report(self, job):
+        """完了したジョブのダウンロード用ファイルの内容を返す"""
+        if job['status'] != 'done' or not job['report_path']:
+            return None
+        with open(job['report_path'], 'rb') as f:
+            return f.read()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'max_per_user': self.max_per_user,
+                'active_jobs': sum(self._active.values()),
+                'active_users': len(self._active),
+            }
+
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """プロセス全体で共有するジョブ管理を返す（全セッション共通）"""
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None:
+            _job_manager = JobManager(
+                max_workers=int(os.environ.get('JOB_WORKERS', 2)),
+                max_per_user=int(os.environ.get('JOB_MAX_PER_USER', 1)),
+                result_dir=os.environ.get('JOB_RESULT_DIR', '.job_results'),
+                keep_jobs=int(os.environ.get('JOB_KEEP_PER_USER', 10)),
+                result_ttl_hours=float(os.environ.get('JOB_RESULT_TTL_HOURS', 168))
+            )
+        return _job_manager
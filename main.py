@@ -1,9 +1,21 @@
+import os
+import tempfile
 import streamlit as st
 import pandas as pd
 from datetime import datetime
 from auth import Auth
 from file_processor import FileProcessor
-from database import Database
+from database import Database, INVENTORY_BROWSE_COLUMNS, INVENTORY_BROWSE_LABELS
+from cache import get_shared_cache
+from jobs import get_job_manager
+from instrumentation import recent_runs
+
+# 1ページに表示する行数
+RESULT_PAGE_SIZE = 100
+HISTORY_PAGE_SIZE = 100
+
+# 管理画面を表示するユーザー（カンマ区切り）
+ADMIN_USERS = {name.strip() for name in os.environ.get('ADMIN_USERS', '').split(',') if name.strip()}
 
 def main():
     st.set_page_config(
@@ -80,49 +92,301 @@ def main():
                 type=['csv'],
                 key="yj_code"
             )
+            st.caption("未選択の場合は登録済みの薬品マスタを使用します")
+
+        top_n = st.number_input(
+            "薬品ごとの最大院所数（購入回数の多い順、0は制限なし）",
+            min_value=0,
+            value=0,
+            step=1
+        )
+        incremental = st.checkbox("前回のアップロードとの差分のみ再処理する", value=True)
+        output_format = st.radio(
+            "出力形式",
+            ["院所別シート（1ファイル）", "院所別ファイル（ZIP）"],
+            horizontal=True
+        )
+
+        manager = get_job_manager()
+        username = st.session_state['username']
 
-        if purchase_file and inventory_file and yj_code_file:
+        if st.button("処理を開始", disabled=not (purchase_file and inventory_file)):
             try:
-                with st.spinner('データを処理中...'):
-                    # ファイル読み込み
-                    purchase_df = FileProcessor.read_excel(purchase_file)
-                    inventory_df = FileProcessor.read_csv(inventory_file, file_type='inventory')
-                    yj_code_df = FileProcessor.read_csv(yj_code_file)
-
-                    # データ処理
-                    result_df = FileProcessor.process_data(
-                        purchase_df,
-                        inventory_df,
-                        yj_code_df
-                    )
-
-                    # 結果の表示
-                    st.subheader("処理結果")
-                    st.dataframe(result_df)
-
-                    # Excelダウンロードボタン
-                    excel = FileProcessor.generate_excel(result_df)
-                    # 現在の日付を取得してファイル名を生成
-                    current_date = datetime.now().strftime('%Y%m%d')
-                    excel_filename = f"不良在庫_法人別_{current_date}.xlsx"
-                    
-                    st.download_button(
-                        label="Excel形式でダウンロード",
-                        data=excel,
-                        file_name=excel_filename,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
-
-                    
-
-                    # データベースへの保存
-                    db = Database()
-                    inventory_data = result_df.values.tolist()
-                    db.save_inventory(inventory_data)
-                    st.success("データベースに保存しました")
+                st.session_state['job_id'] = manager.submit(
+                    username,
+                    purchase_file.getvalue(),
+                    inventory_file.getvalue(),
+                    yj_code_file.getvalue() if yj_code_file else None,
+                    top_n=top_n,
+                    incremental=incremental,
+                    bundle=output_format == "院所別ファイル（ZIP）"
+                )
+            except Exception as e:
+                st.error(f"エラーが発生しました: {str(e)}")
+
+        # ブラウザの再読み込み後も直近のジョブに再接続する
+        jobs = manager.list_jobs(username)
+        if jobs:
+            job_ids = [job['job_id'] for job in jobs]
+            current = st.session_state.get('job_id')
+            selected = st.selectbox(
+                "処理履歴",
+                job_ids,
+                index=job_ids.index(current) if current in job_ids else 0,
+                format_func=lambda job_id: format_job(next(job for job in jobs if job['job_id'] == job_id))
+            )
+            st.session_state['job_id'] = selected
+            job = next(job for job in jobs if job['job_id'] == selected)
+
+            if job['status'] in ('queued', 'running'):
+                render_job_progress(job['job_id'])
+            elif job['status'] == 'failed':
+                st.error(f"エラーが発生しました: {job['message']}")
+            else:
+                try:
+                    render_job_result(manager, job)
+                except Exception as e:
+                    st.error(f"エラーが発生しました: {str(e)}")
+
+        render_inventory_history()
+
+        # 管理者向けの処理時間の内訳
+        if st.session_state['username'] in ADMIN_USERS:
+            render_admin_panel()
+
+
+JOB_STATUS_LABELS = {
+    'queued': '待機中',
+    'running': '処理中',
+    'done': '完了',
+    'failed': 'エラー',
+}
+
+
+def format_job(job):
+    return f"{job['created_at']:%Y-%m-%d %H:%M:%S} {JOB_STATUS_LABELS.get(job['status'], job['status'])}"
+
+
+@st.fragment(run_every=2)
+def render_job_progress(job_id):
+    """実行中のジョブの進捗を定期的に更新して表示する"""
+    manager = get_job_manager()
+    job = manager.get(job_id, st.session_state['username'])
+    if job is None or job['status'] not in ('queued', 'running'):
+        # 完了したら画面全体を再実行して結果を表示する
+        st.rerun()
+
+    current_stage, stages = manager.progress(job_id)
+    status = JOB_STATUS_LABELS[job['status']]
+    st.info(f"データを処理中...（{status}{f': {current_stage}' if current_stage else ''}）")
+    if stages:
+        st.dataframe(
+            pd.DataFrame(stages)[['stage', 'seconds', 'rows_in', 'rows_out']],
+            hide_index=True
+        )
+
+
+def render_job_result(manager, job):
+    result_df = manager.load_result(job)
+
+    # 結果の表示
+    st.subheader("処理結果")
+    report = result_df.attrs.get('incremental_report')
+    if report and not report['full_recompute']:
+        st.caption(
+            f"前回との差分: 追加 {report['added']}件 / 変更 {report['changed']}件 / "
+            f"削除 {report['removed']}件 / 変更なし {report['unchanged']}件"
+        )
+    render_result_browser(result_df)
+
+    # Excelダウンロードボタン（ファイルはジョブの実行時に作成済み）
+    report_file = manager.load_report(job)
+    # 現在の日付を取得してファイル名を生成
+    current_date = datetime.now().strftime('%Y%m%d')
+
+    if report_file is None:
+        st.info("この処理結果のダウンロード用ファイルはありません")
+    elif job['report_path'].endswith('.zip'):
+        st.download_button(
+            label="ZIP形式でダウンロード",
+            data=report_file,
+            file_name=f"不良在庫_院所別_{current_date}.zip",
+            mime="application/zip"
+        )
+    else:
+        excel_filename = f"不良在庫_法人別_{current_date}.xlsx"
+
+        st.download_button(
+            label="Excel形式でダウンロード",
+            data=report_file,
+            file_name=excel_filename,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+
+    # データベースへの保存結果
+    if job['saved_rows'] is None:
+        st.info("同じファイルの処理結果は保存済みです")
+    else:
+        st.success(f"データベースに保存しました（{job['saved_rows']}件）")
+
 
+def reset_page_on_change(state_key, filters, page_key, first_page):
+    # 絞り込み条件が変わったら先頭ページに戻す
+    signature = repr(sorted(filters.items()))
+    if st.session_state.get(state_key) != signature:
+        st.session_state[state_key] = signature
+        st.session_state[page_key] = first_page
+
+
+def expiry_range(value):
+    # date_input の範囲指定（未選択・開始日のみ・開始日と終了日）を (開始, 終了) に変換
+    value = list(value) if isinstance(value, (list, tuple)) else [value]
+    return (value + [None, None])[:2]
+
+
+def render_result_browser(result_df):
+    """処理結果を絞り込み、表示するページの行だけをブラウザに送る"""
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        corporations = sorted(name for name in result_df['法人名'].unique() if name)
+        corporation = st.selectbox(
+            "法人名", [''] + corporations, format_func=lambda name: name or "すべて", key='result_corporation'
+        )
+    with col2:
+        scope = result_df[result_df['法人名'] == corporation] if corporation else result_df
+        institutions = sorted(name for name in scope['院所名'].unique() if name)
+        institution = st.selectbox(
+            "院所名", [''] + institutions, format_func=lambda name: name or "すべて", key='result_institution'
+        )
+    with col3:
+        expiry_from, expiry_to = expiry_range(st.date_input("使用期限", value=(), key='result_expiry'))
+
+    filters = {
+        'corporation': corporation,
+        'institution': institution,
+        'expiry_from': expiry_from,
+        'expiry_to': expiry_to,
+    }
+    filtered = FileProcessor.filter_results(result_df, **filters)
+    pages = max(1, -(-len(filtered) // RESULT_PAGE_SIZE))
+    reset_page_on_change('result_filters', filters, 'result_page', 1)
+    if st.session_state['result_page'] > pages:
+        st.session_state['result_page'] = pages
+    page = st.number_input("ページ", min_value=1, max_value=pages, step=1, key='result_page')
+
+    start = (page - 1) * RESULT_PAGE_SIZE
+    st.dataframe(filtered.iloc[start:start + RESULT_PAGE_SIZE], hide_index=True)
+    st.caption(
+        f"全{len(filtered)}件中 {min(start + 1, len(filtered))}～{min(start + RESULT_PAGE_SIZE, len(filtered))}件"
+        f"（{page}/{pages}ページ）"
+    )
+
+
+def render_inventory_history():
+    """保存済みの在庫データをキーセットページングで閲覧・出力する"""
+    with st.expander("保存済みデータの閲覧"):
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            corporation = st.text_input("法人名", key='history_corporation').strip()
+        with col2:
+            pharmacy_id = st.text_input("院所名", key='history_pharmacy_id').strip()
+        with col3:
+            yj_code = st.text_input("ＹＪコード", key='history_yj_code').strip()
+        with col4:
+            expiry_from, expiry_to = expiry_range(st.date_input("使用期限", value=(), key='history_expiry'))
+
+        filters = {
+            'corporation': corporation,
+            'pharmacy_id': pharmacy_id,
+            'yj_code': yj_code,
+            'expiry_from': expiry_from,
+            'expiry_to': expiry_to,
+        }
+        # 各ページの開始位置（前のページの最終行のキー）を積み上げて前後に移動する
+        reset_page_on_change('history_filters', filters, 'history_cursors', [None])
+        cursors = st.session_state['history_cursors']
+
+        try:
+            db = Database()
+            rows, next_cursor = db.get_inventory(after=cursors[-1], limit=HISTORY_PAGE_SIZE, **filters)
+        except Exception as e:
+            st.error(f"エラーが発生しました: {str(e)}")
+            return
+
+        page_df = pd.DataFrame(rows, columns=INVENTORY_BROWSE_COLUMNS).rename(columns=INVENTORY_BROWSE_LABELS)
+        st.dataframe(page_df, hide_index=True)
+
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            if st.button("前のページ", disabled=len(cursors) == 1):
+                cursors.pop()
+                st.rerun()
+        with col_page:
+            st.caption(f"{len(cursors)}ページ目")
+        with col_next:
+            if st.button("次のページ", disabled=next_cursor is None):
+                cursors.append(next_cursor)
+                st.rerun()
+
+        # 出力は名前付きカーソルで少しずつ読み込み、一時ファイルのCSVに書き出す
+        signature = st.session_state['history_filters']
+        export = st.session_state.get('history_export')
+        if export and export['filters'] != signature:
+            # 絞り込み条件が変わったら前の条件の出力は破棄する
+            discard_history_export()
+        if st.button("絞り込み結果をCSVに出力"):
+            discard_history_export()
+            try:
+                with tempfile.NamedTemporaryFile(
+                    'w', encoding='utf-8-sig', newline='', suffix='.csv', delete=False
+                ) as f:
+                    st.session_state['history_export'] = {'path': f.name, 'filters': signature}
+                    exported = db.export_inventory_csv(f, **filters)
+                st.caption(f"{exported}件を出力しました")
             except Exception as e:
+                discard_history_export()
                 st.error(f"エラーが発生しました: {str(e)}")
+        export = st.session_state.get('history_export')
+        if export:
+            with open(export['path'], 'rb') as f:
+                st.download_button(
+                    label="CSVをダウンロード",
+                    data=f,
+                    file_name=f"在庫履歴_{datetime.now().strftime('%Y%m%d')}.csv",
+                    mime="text/csv",
+                    on_click=discard_history_export
+                )
+
+
+def discard_history_export():
+    # 出力済みの一時ファイルを削除する（ダウンロード後・絞り込み条件の変更時）
+    export = st.session_state.pop('history_export', None)
+    if export:
+        try:
+            os.remove(export['path'])
+        except FileNotFoundError:
+            pass
+
+
+def render_admin_panel():
+    with st.expander("処理時間の内訳（管理者）"):
+        runs = recent_runs()
+        if not runs:
+            st.write("記録された処理はありません")
+        for run in runs:
+            summary = run.summary()
+            st.markdown(
+                f"**{summary['started_at']}** {summary.get('user', '')} "
+                f"{summary['status']} {summary['seconds']:.2f}秒"
+            )
+            stages = pd.DataFrame(run.stages)
+            columns = [c for c in ['stage', 'seconds', 'rows_in', 'rows_out', 'peak_mb', 'rss_mb', 'rss_delta_mb']
+                       if c in stages.columns]
+            st.dataframe(stages[columns], hide_index=True)
+
+        st.caption(f"キャッシュ: {get_shared_cache().stats()}")
+        st.caption(f"DB接続プール: {Database().pool_metrics()}")
+        st.caption(f"ジョブ: {get_job_manager().metrics()}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,50 @@
+import hashlib
+import os
+import threading
+
+import pandas as pd
+
+
+def write_atomic(path, write):
+    """write(一時ファイルのパス) で書き込んだ内容を path に配置する
+
+    書き込み途中のファイルを読まないよう一時ファイル経由で配置する。
+    一時ファイル名にはプロセス・スレッドを含め、同じ path への同時書き込みが衝突しないようにする。
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class SnapshotStore:
+    """差分処理用の在庫スナップショットをディレクトリに保存する
+
+    スナップショットは利用者などの単位（scope）ごとに最新の1件のみ保持する。
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.environ.get('INVENTORY_SNAPSHOT_DIR', '.inventory_snapshots')
+
+    def _path(self, scope):
+        digest = hashlib.sha256(str(scope).encode()).hexdigest()
+        return os.path.join(self.directory, f"inventory_{digest}.pkl")
+
+    def load(self, scope):
+        path = self._path(scope)
+        if not os.path.exists(path):
+            return None
+        try:
+            return pd.read_pickle(path)
+        except Exception:
+            # 壊れたスナップショットは無視して全件処理させる
+            return None
+
+    def save(self, scope, snapshot):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(scope)
+        write_atomic(path, lambda tmp_path: pd.to_pickle(snapshot, tmp_path))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# リポジトリ直下のモジュール（file_processor など）を読み込めるようにする
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
@@ -0,0 +1,43 @@
+import os
+
+import pandas as pd
+import pytest
+
+import batch
+from file_processor import FileProcessor
+
+INVENTORY = '\r\n'.join([''] * 7 + [
+    'JANコード,薬品名,在庫量,使用期限,ロット番号',
+    '4900000000001,アムロジピン錠5mg「サワイ」,10,2026/12/31,L001',
+]) + '\r\n'
+
+
+@pytest.fixture
+def input_files(tmp_path):
+    purchase = tmp_path / 'omec.xlsx'
+    pd.DataFrame(
+        [('2171022F1', '法人A', '院所1', 'アムロジピン錠5mg', '001')], columns=FileProcessor.PURCHASE_COLUMNS
+    ).to_excel(purchase, index=False)
+    master = tmp_path / 'stock_value.csv'
+    pd.DataFrame(
+        [('アムロジピン錠5mg「サワイ」', '2171022F1', '錠')], columns=['薬品名', 'ＹＪコード', '単位']
+    ).to_csv(master, index=False, encoding='cp932')
+    inventory = tmp_path / 'inventory.csv'
+    inventory.write_bytes(INVENTORY.encode('cp932'))
+    return str(purchase), str(master), str(inventory)
+
+
+@pytest.mark.parametrize('as_csv, extension', [(True, '.csv'), (False, '.xlsx')])
+def test_run_batch_writes_one_file_per_set(tmp_path, input_files, as_csv, extension):
+    purchase, master, inventory = input_files
+    names = ['a/b', 'a_b', 'A_B', '', '']
+    sets = [{'name': name, 'purchase': purchase, 'inventory': inventory, 'master': master} for name in names]
+    out_dir = tmp_path / 'out'
+
+    results = batch.run_batch(sets, str(out_dir), max_workers=1, quiet=True, as_csv=as_csv)
+
+    assert [result['status'] for result in results] == ['ok'] * len(names)
+    # 置換後のファイル名（a/b → a_b）や大文字・小文字の違いで上書きしない
+    expected = ['a_b', 'a_b_2', 'A_B_3', 'set', 'set_2']
+    assert [os.path.basename(result['output']) for result in results] == [name + extension for name in expected]
+    assert sorted(os.listdir(out_dir)) == sorted(name + extension for name in expected)
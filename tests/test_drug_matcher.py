@@ -0,0 +1,81 @@
+import pandas as pd
+
+from drug_matcher import (
+    MATCH_EXACT, MATCH_NONE, MATCH_NORMALIZED, MATCH_SIMILAR, DrugNameMatcher, normalize_name
+)
+
+MAPPING = {
+    'アムロジピン錠5mg「サワイ」': ('2171022F1', '錠'),
+    'レバミピド錠100mg「オーツカ」': ('2329021F1', '錠'),
+    'ロキソプロフェンNa錠60mg「A社」': ('1149019F1', '錠'),
+    'ロキソプロフェンNa錠60mg「B社」': ('1149019F2', '錠'),
+    # 正規化すると同じ名前になるがＹＪコードが異なる
+    'セレコキシブ錠100mg': ('1149037F1', '錠'),
+    'セレコキシブ錠 100mg': ('1149037F2', '錠'),
+}
+
+
+def test_normalize_name():
+    assert normalize_name('アムロジピン錠５ｍｇ　「サワイ」') == 'アムロジピン錠5mgサワイ'
+    assert normalize_name('レバミピド錠100ミリグラム（オーツカ）') == 'レバミピド錠100mgオーツカ'
+
+
+def test_exact_match():
+    matcher = DrugNameMatcher(MAPPING)
+    assert matcher.lookup(' アムロジピン錠5mg「サワイ」 ') == ('2171022F1', '錠', MATCH_EXACT, 1.0)
+
+
+def test_normalized_match_absorbs_width_spaces_and_brackets():
+    matcher = DrugNameMatcher(MAPPING)
+    assert matcher.lookup('アムロジピン錠５ｍｇ　（サワイ）') == ('2171022F1', '錠', MATCH_NORMALIZED, 1.0)
+    assert matcher.lookup('レバミピド錠100mg(オーツカ)') == ('2329021F1', '錠', MATCH_NORMALIZED, 1.0)
+
+
+def test_normalized_collision_with_different_codes_is_not_matched():
+    matcher = DrugNameMatcher(MAPPING)
+    # 完全一致は採用し、正規化による照合では曖昧として採用しない
+    assert matcher.lookup('セレコキシブ錠100mg')[2] == MATCH_EXACT
+    assert matcher.lookup('セレコキシブ錠１００ｍｇ') == (None, None, MATCH_NONE, 0.0)
+
+
+def test_similar_match():
+    matcher = DrugNameMatcher(MAPPING)
+    yj_code, unit, method, score = matcher.lookup('アムロジピン錠5mg「サワイ」T')
+    assert (yj_code, unit, method) == ('2171022F1', '錠', MATCH_SIMILAR)
+    assert matcher.min_score <= score < 1.0
+
+
+def test_similar_tie_between_different_codes_is_ambiguous():
+    matcher = DrugNameMatcher(MAPPING)
+    assert matcher._similar(normalize_name('ロキソプロフェンNa錠60mg')) == (None, 0.0)
+
+    # 同点でもＹＪコードが同じなら採用する
+    same_code = DrugNameMatcher({
+        'ロキソプロフェンNa錠60mg「A社」': ('1149019F1', '錠'),
+        'ロキソプロフェンNa錠60mg「B社」': ('1149019F1', '錠'),
+    })
+    index, score = same_code._similar(normalize_name('ロキソプロフェンNa錠60mg'))
+    assert index is not None
+    assert score >= same_code.min_score
+
+
+def test_similar_requires_same_strength_numbers():
+    matcher = DrugNameMatcher(MAPPING)
+    # 名前は十分に類似しているが規格（100mg と 200mg）が異なる
+    assert matcher._similar(normalize_name('レバミピド錠200mg「オーツカ」')) == (None, 0.0)
+    assert matcher.lookup('レバミピド錠200mg「オーツカ」') == (None, None, MATCH_NONE, 0.0)
+
+
+def test_match_returns_one_row_per_name():
+    matcher = DrugNameMatcher(MAPPING)
+    names = pd.Series(
+        ['アムロジピン錠5mg「サワイ」', '不明な薬品', 'アムロジピン錠５ｍｇ「サワイ」', 'アムロジピン錠5mg「サワイ」'],
+        index=[10, 11, 12, 13]
+    )
+
+    result = matcher.match(names)
+
+    assert result.columns.tolist() == ['ＹＪコード', '単位', '照合方法', '照合スコア']
+    assert result.index.tolist() == [10, 11, 12, 13]
+    assert result['照合方法'].tolist() == [MATCH_EXACT, MATCH_NONE, MATCH_NORMALIZED, MATCH_EXACT]
+    assert result['ＹＪコード'].tolist() == ['2171022F1', None, '2171022F1', '2171022F1']
@@ -0,0 +1,37 @@
+import io
+import zipfile
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from file_processor import FileProcessor
+
+
+def result_df():
+    rows = [
+        ('アムロジピン錠5mg', 10, '錠', '001', '2026-12-31', 'L001', '法人A', '院所/1', '2171022F1', '完全一致', 1.0),
+        ('レバミピド錠100mg', 3, '錠', '002', '2027-02-28', 'L002', '法人A', '院所_1', '2329021F1', '完全一致', 1.0),
+        ('レバミピド錠100mg', 5, '錠', '002', '2027-03-31', 'L003', '法人B', '院所2', '2329021F1', '完全一致', 1.0),
+        ('ファモチジン錠20mg', 8, '錠', '003', '2027-04-30', 'L004', '', '', '', '未一致', 0.0),
+    ]
+    df = pd.DataFrame(rows, columns=FileProcessor.RESULT_COLUMNS)
+    df['使用期限'] = pd.to_datetime(df['使用期限'])
+    return FileProcessor._apply_schema(df)
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_bundle_has_one_workbook_per_institution(max_workers):
+    bundle = zipfile.ZipFile(FileProcessor.generate_excel_bundle(result_df(), max_workers=max_workers))
+
+    # 院所名のない行は含めず、同じファイル名になる院所には連番を付ける
+    assert sorted(bundle.namelist()) == ['法人A_院所_1.xlsx', '法人A_院所_1_2.xlsx', '法人B_院所2.xlsx']
+    titles = {
+        name: openpyxl.load_workbook(io.BytesIO(bundle.read(name))).active['A3'].value
+        for name in bundle.namelist()
+    }
+    assert titles == {
+        '法人A_院所_1.xlsx': '法人A 院所/1 御中',
+        '法人A_院所_1_2.xlsx': '法人A 院所_1 御中',
+        '法人B_院所2.xlsx': '法人B 院所2 御中',
+    }
@@ -0,0 +1,101 @@
+import pandas as pd
+import pytest
+
+from file_processor import FileProcessor
+
+MAPPING = {
+    'アムロジピン錠5mg「サワイ」': ('2171022F1', '錠'),
+    'レバミピド錠100mg': ('2329021F1', '錠'),
+    'ファモチジン錠20mg': ('2325003F2', '錠'),
+    'セレコキシブ錠100mg': ('1149037F1', '錠'),
+}
+PURCHASES = [
+    ('2171022F1', '法人A', '院所1', 'アムロジピン錠5mg', '001'),
+    ('2171022F1', '法人B', '院所2', 'アムロジピン錠5mg', '001'),
+    ('2329021F1', '法人A', '院所1', 'レバミピド錠100mg', '002'),
+    ('1149037F1', '法人B', '院所3', 'セレコキシブ錠100mg', '004'),
+]
+PREVIOUS_INVENTORY = [
+    ('アムロジピン錠5mg「サワイ」', 10, '2026/12/31', 'L001'),
+    ('アムロジピン錠5mg「サワイ」', 4, '2026/12/31', 'L001'),
+    ('レバミピド錠100mg', 3, '2027/02/28', 'L002'),
+    ('ファモチジン錠20mg', 8, '2027/03/31', 'L003'),
+]
+CURRENT_INVENTORY = [
+    # 変更なし
+    ('アムロジピン錠5mg「サワイ」', 10, '2026/12/31', 'L001'),
+    # 同じ薬品名・ロットの2行目の在庫量が変更
+    ('アムロジピン錠5mg「サワイ」', 2, '2026/12/31', 'L001'),
+    # 使用期限が変更
+    ('レバミピド錠100mg', 3, '2027/03/31', 'L002'),
+    # 追加（ファモチジンは削除）
+    ('セレコキシブ錠100mg', 7, '2027/04/30', 'L004'),
+]
+
+
+def purchase_df():
+    return pd.DataFrame(PURCHASES, columns=FileProcessor.PURCHASE_COLUMNS)
+
+
+def inventory_df(rows):
+    return pd.DataFrame(rows, columns=FileProcessor.INVENTORY_COLUMNS).astype({'在庫量': str})
+
+
+def canonical(df):
+    # 同じ院所内の並び順は処理方法によって異なるため、全列で並べ替えて比較する
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def run(rows, previous_snapshot=None, context_key='context'):
+    return FileProcessor.process_data_incremental(
+        purchase_df(),
+        inventory_df(rows),
+        previous_snapshot=previous_snapshot,
+        context_key=context_key,
+        yj_mapping=MAPPING
+    )
+
+
+def test_first_run_processes_all_rows():
+    _, snapshot, report = run(PREVIOUS_INVENTORY)
+
+    assert report == {'added': 4, 'changed': 0, 'removed': 0, 'unchanged': 0, 'full_recompute': True}
+    assert snapshot['version'] == FileProcessor.SNAPSHOT_VERSION
+    assert snapshot['context_key'] == 'context'
+
+
+def test_report_counts_added_changed_removed_unchanged():
+    _, snapshot, _ = run(PREVIOUS_INVENTORY)
+    _, _, report = run(CURRENT_INVENTORY, previous_snapshot=snapshot)
+
+    assert report == {'added': 1, 'changed': 2, 'removed': 1, 'unchanged': 1, 'full_recompute': False}
+
+
+def test_incremental_result_matches_full_processing():
+    _, snapshot, _ = run(PREVIOUS_INVENTORY)
+    result_df, next_snapshot, _ = run(CURRENT_INVENTORY, previous_snapshot=snapshot)
+
+    full_df = FileProcessor.process_data(purchase_df(), inventory_df(CURRENT_INVENTORY), yj_mapping=MAPPING)
+
+    pd.testing.assert_frame_equal(canonical(result_df), canonical(full_df))
+    # 次回の差分は今回の在庫データが基準になる
+    unchanged_df, _, report = run(CURRENT_INVENTORY, previous_snapshot=next_snapshot)
+    assert report == {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 4, 'full_recompute': False}
+    pd.testing.assert_frame_equal(canonical(unchanged_df), canonical(full_df))
+
+
+@pytest.mark.parametrize('change', ['context_key', 'version'])
+def test_incompatible_snapshot_is_not_reused(change):
+    _, snapshot, _ = run(PREVIOUS_INVENTORY)
+    context_key = 'context'
+    if change == 'context_key':
+        context_key = 'other'
+    else:
+        snapshot = {**snapshot, 'version': FileProcessor.SNAPSHOT_VERSION - 1}
+
+    result_df, _, report = run(CURRENT_INVENTORY, previous_snapshot=snapshot, context_key=context_key)
+
+    assert report['full_recompute']
+    assert report['added'] == len(CURRENT_INVENTORY)
+    full_df = FileProcessor.process_data(purchase_df(), inventory_df(CURRENT_INVENTORY), yj_mapping=MAPPING)
+    pd.testing.assert_frame_equal(canonical(result_df), canonical(full_df))
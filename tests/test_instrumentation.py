@@ -0,0 +1,45 @@
+import tracemalloc
+
+import pytest
+
+from instrumentation import pipeline_run, stage
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def tracing():
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    yield
+    if started:
+        tracemalloc.stop()
+
+
+def test_stage_records_current_rss():
+    with pipeline_run('test') as run:
+        with stage('allocate'):
+            data = bytearray(32 * MB)
+            data[::4096] = b'x' * len(data[::4096])
+
+    record = run.stages[0]
+    assert record['rss_mb'] > 0
+    assert 'max_rss_mb' not in record
+    assert record['rss_delta_mb'] > 16
+
+
+def test_nested_stage_does_not_reset_parent_peak(tracing):
+    with pipeline_run('test') as run:
+        with stage('outer'):
+            # 内側の段階より前に確保して解放したメモリも外側のピークに含まれる
+            data = bytearray(40 * MB)
+            del data
+            with stage('inner'):
+                data = bytearray(8 * MB)
+                del data
+
+    inner, outer = run.stages
+    assert (inner['stage'], outer['stage']) == ('inner', 'outer')
+    assert 8 <= inner['peak_mb'] < 40
+    assert outer['peak_mb'] >= 40
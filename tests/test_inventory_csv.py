@@ -0,0 +1,116 @@
+import io
+
+import pandas as pd
+import pytest
+
+from file_processor import FileProcessor
+
+PREAMBLE = [
+    '不良在庫一覧',
+    '出力日,2026/10/01',
+    '店舗,テスト薬局',
+    '対象,使用期限180日以内',
+    '',
+    '※テスト用データ',
+    '',
+]
+ROWS = [
+    'JANコード,薬品名,在庫量,使用期限,ロット番号,薬価',
+    '4900000000001,アムロジピン錠5mg「サワイ」,10,2026/12/31,L001,10.1',
+    '4900000000002,,5,2026/12/31,L002,10.1',
+    '4900000000003,ロキソプロフェン錠60mg,-1,2027/01/31,L003,9.8',
+    '4900000000004,レバミピド錠100mg,3,2027/02/28,,12.0',
+    '4900000000005,ファモチジン錠20mg,abc,2027/03/31,L005,8.5',
+    '4900000000006, セレコキシブ錠100mg ,7,不明,NA,30.2',
+]
+
+
+def make_inventory_csv(encoding):
+    return '\r\n'.join(PREAMBLE + ROWS).encode(encoding) + b'\r\n'
+
+
+@pytest.mark.parametrize('encoding', ['cp932', 'utf-8', 'utf-8-sig'])
+def test_pyarrow_engine_matches_c_engine(encoding):
+    pytest.importorskip('pyarrow')
+    file_bytes = make_inventory_csv(encoding)
+
+    c_df, c_report = FileProcessor.read_inventory_csv(file_bytes, encoding, engine='c')
+    arrow_df, arrow_report = FileProcessor.read_inventory_csv(file_bytes, encoding, engine='pyarrow')
+
+    pd.testing.assert_frame_equal(c_df, arrow_df)
+    assert c_report == arrow_report
+
+
+def test_read_inventory_csv_filters_rows():
+    df, report = FileProcessor.read_inventory_csv(make_inventory_csv('cp932'), 'cp932')
+
+    assert report == {'read': 6, 'drug_name_filter': 5, 'quantity_filter': 3}
+    assert df.columns.tolist() == FileProcessor.INVENTORY_COLUMNS
+    assert df['薬品名'].tolist() == ['アムロジピン錠5mg「サワイ」', 'レバミピド錠100mg', 'セレコキシブ錠100mg']
+    assert df['在庫量'].tolist() == [10, 3, 7]
+
+
+def test_chunked_reader_matches_full_read():
+    file_bytes = make_inventory_csv('cp932')
+    full_df, full_report = FileProcessor.read_inventory_csv(file_bytes, 'cp932')
+
+    report = {}
+    chunks = list(FileProcessor.iter_inventory_csv(file_bytes, 'cp932', chunksize=2, report=report))
+
+    pd.testing.assert_frame_equal(pd.concat(chunks), full_df)
+    assert report == full_report
+
+
+@pytest.mark.parametrize('encoding', ['cp932', 'utf-8'])
+def test_detect_encoding_ignores_character_cut_at_sample_boundary(encoding, monkeypatch):
+    file_bytes = make_inventory_csv(encoding)
+    # 先頭部分の末尾がマルチバイト文字の途中になるよう切り詰める
+    name = 'アムロジピン'.encode(encoding)
+    cut = file_bytes.index(name) + len(name) - 1
+    monkeypatch.setattr(FileProcessor, 'CHARDET_SAMPLE_SIZE', cut)
+
+    assert FileProcessor.detect_encoding(file_bytes) == encoding
+    assert FileProcessor.detect_encoding(file_bytes[:cut]) == encoding
+
+
+class RecordingReader(io.BytesIO):
+    """読み込み要求の最大バイト数を記録するファイルオブジェクト"""
+
+    largest_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.largest_read = max(self.largest_read, len(data))
+        return data
+
+    def readinto(self, buffer):
+        count = super().readinto(buffer)
+        self.largest_read = max(self.largest_read, count)
+        return count
+
+
+def test_process_data_chunked_streams_from_file_object(tmp_path):
+    # 読み込みのバッファより十分大きい在庫データ
+    file_bytes = '\r\n'.join(PREAMBLE + ROWS[:1] + ROWS[1:] * 20000).encode('cp932') + b'\r\n'
+    mapping = {'アムロジピン錠5mg「サワイ」': ('2171022F1', '錠')}
+    purchase_df = pd.DataFrame(
+        [('2171022F1', '法人A', '院所1', 'アムロジピン錠5mg', '001')], columns=FileProcessor.PURCHASE_COLUMNS
+    )
+
+    source = RecordingReader(file_bytes)
+    output = io.StringIO()
+    rows = FileProcessor.process_data_chunked(
+        purchase_df, source, None, output, chunksize=5000, yj_mapping=mapping
+    )
+
+    assert source.largest_read < len(file_bytes) // 4
+    full_df = FileProcessor.process_data(
+        purchase_df, FileProcessor.read_csv(io.BytesIO(file_bytes), file_type='inventory'), yj_mapping=mapping
+    )
+    assert rows == len(full_df) == 40000
+
+    path = tmp_path / 'inventory.csv'
+    path.write_bytes(file_bytes)
+    assert FileProcessor.process_data_chunked(
+        purchase_df, path, None, io.StringIO(), chunksize=5000, yj_mapping=mapping
+    ) == rows
@@ -0,0 +1,90 @@
+import io
+
+import pandas as pd
+import pytest
+
+import jobs
+from cache import ResultCache
+from drug_matcher import DrugNameMatcher
+from file_processor import FileProcessor
+
+MAPPING = {
+    'アムロジピン錠5mg「サワイ」': ('2171022F1', '錠'),
+    'レバミピド錠100mg': ('2329021F1', '錠'),
+}
+INVENTORY_HEADER = ['', '', '', '', '', '', '', 'JANコード,薬品名,在庫量,使用期限,ロット番号']
+INVENTORY_ROWS = [
+    '4900000000001,アムロジピン錠5mg「サワイ」,10,2026/12/31,L001',
+    '4900000000002,レバミピド錠100mg,3,2027/02/28,L002',
+    '4900000000003,レバミピド錠100mg,5,2027/03/31,L003',
+]
+
+
+class InMemoryDatabase:
+    """process_upload が使う薬品マスタ・在庫の保存のみを持つテスト用のデータベース"""
+
+    def __init__(self):
+        self.batches = {}
+
+    def update_drug_master(self, yj_code_df):
+        return 0
+
+    def get_drug_master_matcher(self):
+        return 1, DrugNameMatcher(MAPPING)
+
+    def save_inventory(self, result_df, content_hash, result_key):
+        if self.batches.get(content_hash) == result_key:
+            return None
+        self.batches[content_hash] = result_key
+        return len(result_df)
+
+
+def purchase_bytes():
+    buffer = io.BytesIO()
+    pd.DataFrame(
+        [('2171022F1', '法人A', '院所1', 'アムロジピン錠5mg', '001'),
+         ('2329021F1', '法人A', '院所2', 'レバミピド錠100mg', '002')],
+        columns=FileProcessor.PURCHASE_COLUMNS
+    ).to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def inventory_bytes(rows):
+    return '\r\n'.join(INVENTORY_HEADER + rows).encode('cp932') + b'\r\n'
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('INVENTORY_SNAPSHOT_DIR', str(tmp_path / 'snapshots'))
+    cache = ResultCache()
+    monkeypatch.setattr(jobs, 'get_shared_cache', lambda: cache)
+    return cache
+
+
+def test_incremental_result_is_not_shared_between_users():
+    db = InMemoryDatabase()
+    purchase = purchase_bytes()
+
+    jobs.process_upload('alice', purchase, inventory_bytes(INVENTORY_ROWS), db=db)
+    alice_df, alice_key, _ = jobs.process_upload('alice', purchase, inventory_bytes(INVENTORY_ROWS[:2]), db=db)
+    bob_df, bob_key, _ = jobs.process_upload('bob', purchase, inventory_bytes(INVENTORY_ROWS[:2]), db=db)
+
+    assert alice_key != bob_key
+    assert alice_df.attrs['incremental_report']['removed'] == 1
+    assert bob_df.attrs['incremental_report']['full_recompute']
+
+    # bob の次回の差分は bob 自身のスナップショットが基準になる
+    bob_df, _, _ = jobs.process_upload('bob', purchase, inventory_bytes(INVENTORY_ROWS), db=db)
+    report = bob_df.attrs['incremental_report']
+    assert (report['added'], report['unchanged'], report['full_recompute']) == (1, 2, False)
+
+
+def test_same_input_files_are_saved_once():
+    db = InMemoryDatabase()
+    purchase = purchase_bytes()
+
+    _, _, saved_rows = jobs.process_upload('alice', purchase, inventory_bytes(INVENTORY_ROWS), db=db)
+    _, _, saved_again = jobs.process_upload('bob', purchase, inventory_bytes(INVENTORY_ROWS), db=db)
+
+    assert saved_rows == 3
+    assert saved_again is None
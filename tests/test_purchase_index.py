@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+
+from file_processor import FileProcessor
+
+MAPPING = {'アムロジピン錠5mg「サワイ」': ('2171022F1', '錠')}
+# ファイル内の行順は購入日順ではない
+PURCHASES = [
+    ('2025-06-01', '2171022F1', '法人A', '院所1', 'アムロジピン錠5mg', '001'),
+    ('2025-03-01', '2171022F1', '法人A', '院所2', 'アムロジピン錠5mg', '001'),
+    ('2025-01-15', '2171022F1', '法人A', '院所1', 'アムロジピン錠5mg', '001'),
+    ('2025-02-01', '2171022F1', '法人A', '院所1', 'アムロジピン錠5mg', '001'),
+    ('2025-09-30', '2171022F1', '法人B', '院所3', 'アムロジピン錠5mg', '001'),
+    ('2025-04-10', '2171022F1', '法人A', '院所2', 'アムロジピン錠5mg', '001'),
+    ('2025-05-20', '2329021F1', '法人A', '院所1', 'レバミピド錠100mg', '002'),
+]
+
+
+def purchase_df(with_date=True):
+    df = pd.DataFrame(PURCHASES, columns=['購入日'] + FileProcessor.PURCHASE_COLUMNS)
+    return df if with_date else df.drop(columns='購入日')
+
+
+def inventory_df():
+    return pd.DataFrame(
+        [('アムロジピン錠5mg「サワイ」', '10', '2026/12/31', 'L001'),
+         ('アムロジピン錠5mg「サワイ」', '4', '2027/01/31', 'L002')],
+        columns=FileProcessor.INVENTORY_COLUMNS
+    )
+
+
+def institutions(index_df, yj_code='2171022F1'):
+    return index_df.loc[index_df['厚労省CD'] == yj_code, '院所名'].tolist()
+
+
+def test_index_has_one_row_per_institution():
+    index_df = FileProcessor.build_purchase_index(purchase_df())
+
+    assert len(index_df) == 4
+    amlodipine = index_df[index_df['厚労省CD'] == '2171022F1']
+    assert amlodipine['院所名'].tolist() == ['院所1', '院所2', '院所3']
+    assert amlodipine['購入回数'].tolist() == [3, 2, 1]
+
+
+def test_repeated_purchases_do_not_multiply_rows():
+    result_df = FileProcessor.process_data(purchase_df(), inventory_df(), yj_mapping=MAPPING)
+
+    # 在庫2行 × 購入実績のある院所3件（購入回数によらない）
+    assert len(result_df) == 6
+    assert not result_df.duplicated().any()
+
+
+def test_top_n_limits_institutions_per_drug():
+    result_df = FileProcessor.process_data(purchase_df(), inventory_df(), yj_mapping=MAPPING, top_n=1)
+
+    assert len(result_df) == 2
+    assert set(result_df['院所名']) == {'院所1'}
+
+
+@pytest.mark.parametrize('with_date, expected', [
+    # 購入日の新しい順
+    (True, ['院所3', '院所1', '院所2']),
+    # 購入日がない場合はファイル内で後の行ほど新しいとみなす
+    (False, ['院所2', '院所3', '院所1']),
+])
+def test_recency_ranking(with_date, expected):
+    index_df = FileProcessor.build_purchase_index(purchase_df(with_date), rank_by='recency')
+
+    assert institutions(index_df) == expected
+
+
+def test_unknown_ranking_is_rejected():
+    with pytest.raises(ValueError):
+        FileProcessor.build_purchase_index(purchase_df(), rank_by='price')